@@ -5,6 +5,9 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
+from django.contrib.auth.signals import user_logged_in
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import User
 from .serializers import (
     UserSerializer,
@@ -134,4 +137,17 @@ class RegistrationViewSet(viewsets.GenericViewSet):
                 'user': UserSerializer(user).data
             },
             status=status.HTTP_201_CREATED
-        )
\ No newline at end of file
+        )
+
+class LoginView(TokenObtainPairView):
+    """Obtain a JWT pair; sends user_logged_in like a session login does"""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        user_logged_in.send(sender=serializer.user.__class__, request=request, user=serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
@@ -0,0 +1,69 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from apps.carts.models import Cart, CartItem
+from apps.carts.storage import merge_guest_cart
+from apps.catalog.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Benchmark merging a guest cart into a user cart on login (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=500, help='Lines in the guest cart')
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        lines = options['lines']
+        timings = []
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username='bench-merge', password='x')
+            products = Product.objects.bulk_create([
+                Product(sku=f'MERGE-{i}', slug=f'merge-{i}', name=f'Merge {i}', price=Decimal('9.99'), stock=1000)
+                for i in range(lines)
+            ])
+
+            for run in range(options['runs']):
+                with transaction.atomic():
+                    # The user already holds every other product; the guest holds all of them
+                    cart = Cart.objects.create(user=user)
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=cart, product=p, quantity=1, unit_price=p.price, subtotal=p.price)
+                        for p in products[::2]
+                    ])
+                    cart.recompute_totals()
+                    guest = Cart.objects.create(session_key=f'bench-{run}')
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=guest, product=p, quantity=2, unit_price=p.price, subtotal=2 * p.price)
+                        for p in products
+                    ])
+
+                    request = RequestFactory().post('/api/token/')
+                    request.COOKIES[settings.SESSION_COOKIE_NAME] = guest.session_key
+                    request.session = SessionBase()
+
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        merge_guest_cart(request, user)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    transaction.set_rollback(True)
+
+            transaction.set_rollback(True)
+
+        timings.sort()
+        self.stdout.write(f'Lines: {lines}, queries per merge: {len(ctx.captured_queries)}')
+        self.stdout.write(
+            f'p50 {statistics.median(timings):.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, '
+            f'max {timings[-1]:.2f} ms'
+        )
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.carts.reaper import reap_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous and inactive carts idle for too long, plus expired sessions, in bounded chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CART_ABANDONED_AFTER_DAYS,
+            help='Idle age in days after which a cart is abandoned'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        result = reap_abandoned_carts(
+            idle_days=options['days'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            pause=options['sleep'],
+        )
+        rows = result['carts'] + result['items'] + result['sessions']
+
+        if options['dry_run']:
+            self.stdout.write(
+                f"Would delete {result['carts']} carts ({result['items']} items) "
+                f"and {result['sessions']} expired sessions, "
+                f"in about {-(-result['carts'] // options['batch_size'])} cart batches"
+            )
+            return
+
+        rate = rows / result['seconds'] if result['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {result['carts']} carts ({result['items']} items) "
+            f"and {result['sessions']} expired sessions in {result['seconds']:.2f} s ({rate:.0f} rows/s)"
+        ))
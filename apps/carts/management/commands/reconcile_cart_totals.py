@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from apps.carts.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Detect (and with --fix, repair) drift between stored cart totals and their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite drifted totals')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        actual = {
+            'actual_amount': Coalesce(
+                Subquery(items.annotate(s=Sum('subtotal')).values('s')), Value(Decimal('0.00'))
+            ),
+            'actual_items': Coalesce(Subquery(items.annotate(s=Sum('quantity')).values('s')), Value(0)),
+            'actual_lines': Coalesce(Subquery(items.annotate(c=Count('id')).values('c')), Value(0)),
+        }
+
+        drifted = fixed = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Cart.objects.filter(pk__gt=last_id).order_by('pk').annotate(**actual)
+                .values('pk', 'total_amount', 'total_items', 'line_count', *actual)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['pk']
+
+            for row in batch:
+                if (
+                    row['total_amount'] == row['actual_amount'] and
+                    row['total_items'] == row['actual_items'] and
+                    row['line_count'] == row['actual_lines']
+                ):
+                    continue
+                drifted += 1
+                self.stdout.write(
+                    f"Cart #{row['pk']}: stored {row['total_amount']}/{row['total_items']}/{row['line_count']}, "
+                    f"actual {row['actual_amount']}/{row['actual_items']}/{row['actual_lines']}"
+                )
+                if options['fix']:
+                    # Recompute inside the UPDATE so concurrent item writes are not overwritten with stale values
+                    fixed += Cart.objects.filter(pk=row['pk']).update(
+                        total_amount=actual['actual_amount'],
+                        total_items=actual['actual_items'],
+                        line_count=actual['actual_lines'],
+                        # Summary ETags carry the version; without a bump clients keep the wrong totals
+                        version=F('version') + 1,
+                    )
+
+        message = f'{drifted} carts drifted'
+        if options['fix']:
+            message += f', {fixed} repaired'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:30
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        total_amount=Coalesce(Subquery(items.annotate(s=Sum('subtotal')).values('s')), Value(Decimal('0.00'))),
+        total_items=Coalesce(Subquery(items.annotate(s=Sum('quantity')).values('s')), Value(0)),
+        line_count=Coalesce(Subquery(items.annotate(c=Count('id')).values('c')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0002_alter_cartitem_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Line count'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Total amount'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total items'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
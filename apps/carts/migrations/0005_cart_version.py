@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0004_cart_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version'),
+        ),
+    ]
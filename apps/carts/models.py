@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
 from decimal import Decimal
 from django.conf import settings
+from django.utils import timezone
 
 class Cart(models.Model):
     user = models.ForeignKey(
@@ -18,31 +21,157 @@ class Cart(models.Model):
         db_index=True
     )
     is_active = models.BooleanField('Active', default=True)
+    # Denormalized from the cart items, kept current by CartItem writes
+    total_amount = models.DecimalField(
+        'Total amount',
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    total_items = models.PositiveIntegerField('Total items', default=0)
+    line_count = models.PositiveIntegerField('Line count', default=0)
+    # Incremented by every item write; cheap change detection for pollers
+    version = models.PositiveIntegerField('Version', default=0)
     created_at = models.DateTimeField('Created at', auto_now_add=True)
     updated_at = models.DateTimeField('Updated at', auto_now=True)
     class Meta:
         verbose_name = 'Cart'
         verbose_name_plural = 'Carts'
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
     
     def __str__(self):
         owner = self.user.username if self.user else f"anon ({self.session_key})"
         return f"Cart #{self.pk} - {owner}"
-    
-    @property
-    def total_amount(self):
-        return self.items.aggregate(
-            total=models.Sum('subtotal')
-        )['total'] or Decimal('0.00')
-    
+
+    @classmethod
+    def apply_totals_delta(cls, cart_id, amount=Decimal('0.00'), items=0, lines=0):
+        """Shift the stored totals of a cart with a single F-expression UPDATE"""
+        cls.objects.filter(pk=cart_id).update(
+            total_amount=Greatest(F('total_amount') + Value(amount), Value(Decimal('0.00'))),
+            total_items=Greatest(F('total_items') + Value(items), Value(0)),
+            line_count=Greatest(F('line_count') + Value(lines), Value(0)),
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+
     @property
-    def total_items(self):
-        return self.items.aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
+    def cart_items(self):
+        """Items to render: lines loaded by a cart storage backend, else the stored rows"""
+        if hasattr(self, 'loaded_items'):
+            return self.loaded_items
+        return self.items.all()
+
+    def set_loaded_items(self, items):
+        """Render these lines; the totals are computed from them instead of re-read"""
+        self.loaded_items = items
+        self.total_amount = sum((item.subtotal for item in items), Decimal('0.00'))
+        self.total_items = sum(item.quantity for item in items)
+        self.line_count = len(items)
+
+    def recompute_totals(self):
+        """Rewrite the stored totals from the items inside a single UPDATE"""
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        Cart.objects.filter(pk=self.pk).update(
+            total_amount=Coalesce(
+                Subquery(items.annotate(s=models.Sum('subtotal')).values('s')), Value(Decimal('0.00'))
+            ),
+            total_items=Coalesce(Subquery(items.annotate(s=models.Sum('quantity')).values('s')), Value(0)),
+            line_count=Coalesce(Subquery(items.annotate(c=models.Count('id')).values('c')), Value(0)),
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+
+    def merge_lines(self, lines):
+        """
+        Add {product_id: (quantity, unit_price)} to this cart with one upsert
+        on (cart, product), clamping every merged line to the product stock.
+        Lines already in the cart keep their unit price.
+        """
+        from apps.catalog.models import Product
+
+        if not lines:
+            return
+        existing = {
+            product_id: (quantity, unit_price)
+            for product_id, quantity, unit_price in self.items.filter(product_id__in=lines)
+            .values_list('product_id', 'quantity', 'unit_price')
+        }
+        stock = dict(Product.objects.filter(pk__in=lines).values_list('pk', 'stock'))
+
+        now = timezone.now()
+        rows = []
+        for product_id, (quantity, unit_price) in lines.items():
+            current_quantity, current_price = existing.get(product_id, (0, unit_price))
+            quantity = min(current_quantity + quantity, stock.get(product_id, 0))
+            if quantity <= 0:
+                continue
+            rows.append(CartItem(
+                cart=self,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=current_price,
+                subtotal=quantity * current_price,
+                updated_at=now,
+            ))
+
+        with transaction.atomic():
+            CartItem.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'subtotal', 'updated_at'],
+            )
+            # Upserts bypass CartItem.save, so the totals are recomputed in the database
+            self.recompute_totals()
+
+    def reprice(self, items):
+        """
+        Bring loaded lines (with their products) to the current product
+        prices with one bulk UPDATE. Changed lines keep their old price in
+        `previous_unit_price`; the changed lines are returned.
+        """
+        now = timezone.now()
+        changed = []
+        for item in items:
+            if item.unit_price != item.product.price:
+                item.previous_unit_price = item.unit_price
+                item.unit_price = item.product.price
+                item.subtotal = item.quantity * item.unit_price
+                item.updated_at = now
+                changed.append(item)
+        if not changed:
+            return changed
+
+        amount = sum((item.subtotal - item._stored[1] for item in changed), Decimal('0.00'))
+        with transaction.atomic():
+            CartItem.objects.bulk_update(changed, ['unit_price', 'subtotal', 'updated_at'])
+            Cart.apply_totals_delta(self.pk, amount)
+        for item in changed:
+            item._stored = (item.quantity, item.subtotal)
+        self.total_amount += amount
+        return changed
+
+    def computed_totals(self):
+        """Totals recomputed from the items, used to detect drift"""
+        totals = self.items.aggregate(
+            amount=models.Sum('subtotal'),
+            items=models.Sum('quantity'),
+            lines=models.Count('id')
+        )
+        return {
+            'total_amount': totals['amount'] or Decimal('0.00'),
+            'total_items': totals['items'] or 0,
+            'line_count': totals['lines'],
+        }
     
     def clear(self):
         self.items.all().delete()
+        self.total_amount = Decimal('0.00')
+        self.total_items = 0
+        self.line_count = 0
 
     def add_item(self, product, quantity=1):
         cart_item, created = CartItem.objects.get_or_create(
@@ -68,6 +197,20 @@ class Cart(models.Model):
         except CartItem.DoesNotExist:
             return False
 
+class CartItemQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete items and take them off their carts' stored totals"""
+        with transaction.atomic():
+            totals = self.order_by().values('cart_id').annotate(
+                amount=models.Sum('subtotal'),
+                items=models.Sum('quantity'),
+                lines=models.Count('id')
+            )
+            for row in totals:
+                Cart.apply_totals_delta(row['cart_id'], -row['amount'], -row['items'], -row['lines'])
+            return super().delete()
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(
         Cart,
@@ -92,22 +235,66 @@ class CartItem(models.Model):
     )
     added_at = models.DateTimeField('Added at', auto_now_add=True)
     updated_at = models.DateTimeField('Updated at', auto_now=True)
+
+    objects = CartItemQuerySet.as_manager()
+
+    # Set by Cart.reprice() on lines whose price moved since they were added
+    previous_unit_price = None
+
     class Meta:
         verbose_name = 'Cart Item'
         verbose_name_plural = 'Cart Items'
         unique_together = ('cart', 'product')
         ordering = ['added_at']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so saves can adjust the cart totals by the difference
+        instance._stored = (instance.__dict__.get('quantity'), instance.__dict__.get('subtotal'))
+        return instance
     
     def save(self, *args, **kwargs):
+        adding = self._state.adding
+        old_quantity, old_subtotal = getattr(self, '_stored', (0, Decimal('0.00')))
+        if adding:
+            old_quantity, old_subtotal = 0, Decimal('0.00')
+
         if not self.unit_price:
             self.unit_price = self.product.price
-        
-        if self.quantity > self.product.stock:
+
+        # Only a growing line can run out of stock; shrinking or repricing one
+        # needs no product row (callers pass the product they already hold)
+        if self.quantity > (old_quantity or 0) and self.quantity > self.product.stock:
             raise ValueError(f"Not enough stock.  Available: {self.product.stock}")
-        
+
         self.subtotal = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Cart.apply_totals_delta(
+                self.cart_id,
+                self.subtotal - (old_subtotal or Decimal('0.00')),
+                self.quantity - (old_quantity or 0),
+                1 if adding else 0
+            )
+        self._stored = (self.quantity, self.subtotal)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Cart.apply_totals_delta(self.cart_id, -self.subtotal, -self.quantity, -1)
+            return super().delete(*args, **kwargs)
 
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product.name}"
+
+# Signals to carry the guest cart over on sign-in
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .storage import merge_guest_cart
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if request is not None:
+        merge_guest_cart(request, user)
@@ -0,0 +1,81 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+
+def abandoned_carts(now=None, idle_days=None):
+    """Anonymous and inactive carts untouched for more than `idle_days`"""
+    now = now or timezone.now()
+    idle_days = settings.CART_ABANDONED_AFTER_DAYS if idle_days is None else idle_days
+    return Cart.objects.filter(
+        Q(user__isnull=True) | Q(is_active=False),
+        updated_at__lt=now - timedelta(days=idle_days),
+    )
+
+
+def _keyset_batches(queryset, batch_size):
+    """Yield lists of (pk, updated_at), walking (updated_at, id) without OFFSET"""
+    last = None
+    while True:
+        batch = queryset.order_by('updated_at', 'pk')
+        if last is not None:
+            batch = batch.filter(
+                Q(updated_at__gt=last[1]) | Q(updated_at=last[1], pk__gt=last[0])
+            )
+        rows = list(batch.values_list('pk', 'updated_at')[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+
+def reap_abandoned_carts(idle_days=None, batch_size=1000, dry_run=False, pause=0.0):
+    """
+    Delete abandoned carts and expired sessions in bounded chunks.
+
+    Each chunk is its own short transaction, so no lock is held for more
+    than one batch; `pause` seconds between chunks leave room for other
+    writers. Safe to run from cron or any task scheduler. Returns a dict
+    of counts and the elapsed time; with `dry_run` nothing is deleted and
+    the counts are what a real run would remove.
+    """
+    now = timezone.now()
+    carts = abandoned_carts(now, idle_days)
+    sessions = Session.objects.filter(expire_date__lt=now)
+    started = time.perf_counter()
+
+    if dry_run:
+        return {
+            'carts': carts.count(),
+            'items': CartItem.objects.filter(cart__in=carts).count(),
+            'sessions': sessions.count(),
+            'seconds': time.perf_counter() - started,
+        }
+
+    result = {'carts': 0, 'items': 0, 'sessions': 0}
+    for rows in _keyset_batches(carts, batch_size):
+        with transaction.atomic():
+            # The idle condition is applied again, so a cart touched since it was read is kept
+            deleted, per_model = carts.filter(pk__in=[pk for pk, _ in rows]).delete()
+        result['carts'] += per_model.get(Cart._meta.label, 0)
+        result['items'] += per_model.get(CartItem._meta.label, 0)
+        if pause:
+            time.sleep(pause)
+
+    while True:
+        keys = list(sessions.values_list('session_key', flat=True)[:batch_size])
+        if not keys:
+            break
+        result['sessions'] += Session.objects.filter(session_key__in=keys).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+    result['seconds'] = time.perf_counter() - started
+    return result
@@ -10,6 +10,10 @@ class CartItemSerializer(serializers.ModelSerializer):
     
     product_details = ProductListSerializer(source='product', read_only=True)
     subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    previous_unit_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, read_only=True, allow_null=True
+    )
+    price_changed = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
@@ -21,11 +25,16 @@ class CartItemSerializer(serializers.ModelSerializer):
             'quantity',
             'unit_price',
             'subtotal',
+            'price_changed',
+            'previous_unit_price',
             'added_at',
             'updated_at',
         ]
         read_only_fields = ['id', 'unit_price', 'subtotal', 'added_at', 'updated_at']
 
+    def get_price_changed(self, obj):
+        return obj.previous_unit_price is not None
+
     def validate_quantity(self, value):
         if value <= 0:
             raise serializers.ValidationError("Quantity must be greater than 0.")
@@ -71,7 +80,7 @@ class CartItemSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     """Cart serializer with items and totals"""
     
-    items = CartItemSerializer(many=True, read_only=True)
+    items = CartItemSerializer(source='cart_items', many=True, read_only=True)
     total_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
     items_count = serializers.SerializerMethodField()
@@ -101,7 +110,7 @@ class CartSerializer(serializers.ModelSerializer):
         ]
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return obj.line_count
 
 
 class AddToCartSerializer(serializers.Serializer):
@@ -150,3 +159,28 @@ class RemoveFromCartSerializer(serializers.Serializer):
     product = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.filter(is_active=True)
     )
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """One add/set/remove operation of a batch cart update"""
+
+    OP_CHOICES = [
+        ('add', 'Add'),
+        ('set', 'Set'),
+        ('remove', 'Remove'),
+    ]
+
+    op = serializers.ChoiceField(choices=OP_CHOICES)
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] == 0:
+            raise serializers.ValidationError("Quantity must be greater than 0.")
+        return data
+
+
+class BatchCartSerializer(serializers.Serializer):
+    """Serializer for applying several cart operations at once"""
+
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
@@ -0,0 +1,589 @@
+import hashlib
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.catalog.models import Product, listing_prefetches
+from apps.catalog.stock import InsufficientStock
+from .models import Cart, CartItem
+
+
+class CartItemNotFound(Exception):
+    """The product is not in the cart"""
+
+
+class ProductUnavailable(Exception):
+    """Inactive products a cart operation would add or increase"""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__(f"Products not available: {products}")
+
+
+def plan_batch(current, operations, products):
+    """
+    Final {product_id: quantity} after applying add/set/remove operations in
+    order to the current quantities. Every line that grows is checked at
+    once: ProductUnavailable lists inactive products and InsufficientStock
+    all short ones. Shrinking or removing a line is always allowed.
+    """
+    quantities = dict(current)
+    touched = set()
+    for operation in operations:
+        product_id = operation['product']
+        touched.add(product_id)
+        if operation['op'] == 'add':
+            quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+        elif operation['op'] == 'set':
+            quantities[product_id] = operation['quantity']
+        else:
+            quantities.pop(product_id, None)
+
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    grown = sorted(pk for pk in touched if quantities.get(pk, 0) > current.get(pk, 0))
+    unavailable = [product_id for product_id in grown if not products[product_id].is_active]
+    if unavailable:
+        raise ProductUnavailable(unavailable)
+    shortfalls = [
+        {
+            'product': product_id,
+            'sku': products[product_id].sku,
+            'requested': quantities[product_id],
+            'available': products[product_id].stock,
+        }
+        for product_id in grown
+        if quantities[product_id] > products[product_id].stock
+    ]
+    if shortfalls:
+        raise InsufficientStock(shortfalls)
+    return quantities
+
+
+class BaseCartStorage:
+    """
+    Where the cart of the current request lives.
+
+    CartViewSet only talks to this interface, so every backend serves the
+    same API contract. Stock problems are raised as ValueError and missing
+    lines as CartItemNotFound.
+    """
+
+    # Identifies a guest cart held outside the database, if any
+    token = None
+
+    def __init__(self, request):
+        self.request = request
+
+    def load(self, reprice=False):
+        """
+        Cart instance ready to be rendered by CartSerializer. With `reprice`,
+        lines are first moved to the current product prices and the changed
+        ones are flagged with `previous_unit_price`.
+        """
+        raise NotImplementedError
+
+    def add_item(self, product, quantity):
+        raise NotImplementedError
+
+    def remove_item(self, product):
+        raise NotImplementedError
+
+    def update_item(self, product, quantity):
+        """Set the quantity of a line; 0 removes it"""
+        raise NotImplementedError
+
+    def apply_batch(self, operations, products):
+        """
+        Apply add/set/remove operations in one pass. `products` maps every
+        referenced product id to its Product, loaded up front.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def totals(self):
+        """(total_items, total_amount) without rendering the items"""
+        raise NotImplementedError
+
+    def summary(self):
+        """
+        Stored count, total and version of the cart, or None when there is
+        no cart. Never creates a cart, a session or a cache entry.
+        """
+        raise NotImplementedError
+
+    def materialize(self, cart):
+        """Move guest lines into the database cart of a user who just signed in"""
+
+    def finalize_response(self, response):
+        """Hook to attach cookies or headers the backend needs"""
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    """Carts stored as Cart/CartItem rows, guests keyed by their session"""
+
+    def __init__(self, request, guest=None):
+        super().__init__(request)
+        self.guest = guest
+        self._cart = None
+        self._dirty = False
+
+    def get_cart(self):
+        """Get or create cart for current user/session"""
+        if self._cart is not None:
+            return self._cart
+
+        user = self.request.user
+        session_key = self.request.session.session_key
+
+        if user.is_authenticated:
+            # First try to find existing cart for user
+            cart = Cart.objects.filter(user=user, is_active=True).first()
+
+            # If no user cart, check for session cart and merge
+            if not cart and session_key:
+                cart = Cart.objects.filter(
+                    session_key=session_key,
+                    is_active=True,
+                    user__isnull=True
+                ).first()
+
+                if cart:
+                    # Convert session cart to user cart
+                    cart.user = user
+                    cart.save()
+
+            # Create new user cart
+            if not cart:
+                cart = Cart.objects.create(user=user)
+        else:
+            # Guest user
+            if not session_key:
+                self.request.session.create()
+                session_key = self.request.session.session_key
+
+            cart, created = Cart.objects.get_or_create(
+                session_key=session_key,
+                is_active=True,
+                user__isnull=True
+            )
+
+        self._cart = cart
+        return cart
+
+    def materialize_guest(self):
+        """Move the lines of a guest cart held by another backend into this cart"""
+        if self.guest is not None and self.guest.token:
+            self.guest.materialize(self.get_cart())
+            self._dirty = True
+
+    def load(self, reprice=False):
+        cart = self.get_cart()
+        items = getattr(cart, 'loaded_items', None)
+        if items is None:
+            # Items and their products in one joined query; the listing fields
+            # of the products come from the fixed catalog prefetches
+            items = list(
+                cart.items.select_related('product').prefetch_related(*listing_prefetches('product__'))
+            )
+        if reprice:
+            cart.reprice(items)
+        cart.set_loaded_items(items)
+        if self._dirty:
+            # Item writes bumped the stored timestamp; no need to re-read it
+            cart.updated_at = timezone.now()
+        return cart
+
+    def add_item(self, product, quantity):
+        cart = self.get_cart()
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=cart,
+            product=product,
+            defaults={
+                'quantity': quantity,
+                'unit_price': product.price
+            }
+        )
+
+        if not created:
+            cart_item.product = product
+            new_quantity = cart_item.quantity + quantity
+            if new_quantity > product.stock:
+                raise ValueError(f'Not enough stock. Available: {product.stock}')
+            cart_item.quantity = new_quantity
+            cart_item.save()
+        self._dirty = True
+
+    def remove_item(self, product):
+        try:
+            CartItem.objects.get(cart=self.get_cart(), product=product).delete()
+        except CartItem.DoesNotExist:
+            raise CartItemNotFound()
+        self._dirty = True
+
+    def update_item(self, product, quantity):
+        try:
+            cart_item = CartItem.objects.get(cart=self.get_cart(), product=product)
+        except CartItem.DoesNotExist:
+            raise CartItemNotFound()
+        cart_item.product = product
+
+        if quantity == 0:
+            cart_item.delete()
+        else:
+            if quantity > product.stock:
+                raise ValueError(f'Not enough stock. Available: {product.stock}')
+            cart_item.quantity = quantity
+            cart_item.save()
+        self._dirty = True
+
+    def apply_batch(self, operations, products):
+        cart = self.get_cart()
+        existing = {
+            item.product_id: item
+            for item in cart.items.select_related('product').prefetch_related(*listing_prefetches('product__'))
+        }
+        quantities = plan_batch(
+            {pk: item.quantity for pk, item in existing.items()}, operations, products
+        )
+
+        now = timezone.now()
+        created, changed = [], []
+        for product_id, quantity in quantities.items():
+            item = existing.get(product_id)
+            if item is None:
+                product = products[product_id]
+                created.append(CartItem(
+                    cart=cart,
+                    product=product,
+                    quantity=quantity,
+                    unit_price=product.price,
+                    subtotal=quantity * product.price,
+                ))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                item.subtotal = quantity * item.unit_price
+                item.updated_at = now
+                changed.append(item)
+        removed = [item.pk for pk, item in existing.items() if pk not in quantities]
+
+        # Bulk writes skip CartItem.save, so the stored totals move by one delta
+        amount = sum((item.subtotal for item in created), Decimal('0.00'))
+        items = sum(item.quantity for item in created)
+        for item in changed:
+            old_quantity, old_subtotal = item._stored
+            amount += item.subtotal - old_subtotal
+            items += item.quantity - old_quantity
+            item._stored = (item.quantity, item.subtotal)
+
+        with transaction.atomic():
+            CartItem.objects.bulk_create(created)
+            CartItem.objects.bulk_update(changed, ['quantity', 'subtotal', 'updated_at'])
+            if created or changed:
+                Cart.apply_totals_delta(cart.pk, amount, items, len(created))
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+
+        kept = [item for pk, item in existing.items() if pk in quantities]
+        cart.set_loaded_items(sorted(kept + created, key=lambda item: item.added_at))
+        self._dirty = True
+
+    def clear(self):
+        self.get_cart().clear()
+
+    def totals(self):
+        cart = self.get_cart()
+        return cart.total_items, cart.total_amount
+
+    def summary(self):
+        user = self.request.user
+        if user.is_authenticated:
+            carts = Cart.objects.filter(user=user, is_active=True)
+        elif self.request.session.session_key:
+            carts = Cart.objects.filter(
+                session_key=self.request.session.session_key, is_active=True, user__isnull=True
+            )
+        else:
+            return None
+        row = carts.values('pk', 'version', 'total_items', 'total_amount', 'line_count').first()
+        if row is None:
+            return None
+        return {
+            'etag': f"{row['pk']}-{row['version']}",
+            'count': row['total_items'],
+            'total_amount': row['total_amount'],
+            'items_count': row['line_count'],
+        }
+
+    def finalize_response(self, response):
+        if self.guest is not None:
+            self.guest.finalize_response(response)
+
+
+class CacheCartStorage(BaseCartStorage):
+    """
+    Guest carts kept in a key-value cache instead of the database.
+
+    A random token in a cookie names the cache entry; nothing is written
+    until the first mutation, and idle carts are evicted after
+    CART_GUEST_TTL seconds. The lines are materialized into Cart/CartItem
+    rows once the guest signs in.
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+        self.token = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        self._data = None
+        self._written = False
+        self._discarded = False
+
+    def _key(self):
+        return f'carts:guest:{self.token}'
+
+    def _read(self):
+        if self._data is None:
+            data = self.cache.get(self._key()) if self.token else None
+            if data is None:
+                now = timezone.now()
+                # The nonce tells a recreated entry (version restarting at 1) from the one it replaced
+                data = {'created_at': now, 'updated_at': now, 'nonce': secrets.token_hex(8), 'items': {}}
+            self._data = data
+        return self._data
+
+    def _write(self):
+        if not self.token:
+            self.token = secrets.token_urlsafe(32)
+        self._data['updated_at'] = timezone.now()
+        self._data['version'] = self._data.get('version', 0) + 1
+        self.cache.set(self._key(), self._data, settings.CART_GUEST_TTL)
+        self._written = True
+
+    def load(self, reprice=False):
+        data = self._read()
+        lines = data['items']
+        products = Product.objects.with_listing_data().in_bulk([int(pk) for pk in lines])
+
+        items = []
+        repriced = {}
+        for product_id, line in lines.items():
+            product = products.get(int(product_id))
+            if product is None:
+                continue
+            if reprice and line['unit_price'] != product.price:
+                repriced[product_id] = line['unit_price']
+                line.update(unit_price=product.price, updated_at=timezone.now())
+            items.append(CartItem(
+                product=product,
+                quantity=line['quantity'],
+                unit_price=line['unit_price'],
+                subtotal=line['quantity'] * line['unit_price'],
+                added_at=line['added_at'],
+                updated_at=line['updated_at'],
+            ))
+        for item in items:
+            item.previous_unit_price = repriced.get(str(item.product.pk))
+        items.sort(key=lambda item: item.added_at)
+        if repriced:
+            self._write()
+
+        cart = Cart(
+            is_active=True,
+            created_at=data['created_at'],
+            updated_at=data['updated_at'],
+        )
+        cart.set_loaded_items(items)
+        return cart
+
+    def add_item(self, product, quantity):
+        lines = self._read()['items']
+        now = timezone.now()
+        line = lines.get(str(product.pk))
+        if line is None:
+            if quantity > product.stock:
+                raise ValueError(f'Not enough stock. Available: {product.stock}')
+            lines[str(product.pk)] = {
+                'quantity': quantity,
+                'unit_price': product.price,
+                'added_at': now,
+                'updated_at': now,
+            }
+        else:
+            new_quantity = line['quantity'] + quantity
+            if new_quantity > product.stock:
+                raise ValueError(f'Not enough stock. Available: {product.stock}')
+            line.update(quantity=new_quantity, updated_at=now)
+        self._write()
+
+    def remove_item(self, product):
+        if self._read()['items'].pop(str(product.pk), None) is None:
+            raise CartItemNotFound()
+        self._write()
+
+    def update_item(self, product, quantity):
+        lines = self._read()['items']
+        line = lines.get(str(product.pk))
+        if line is None:
+            raise CartItemNotFound()
+
+        if quantity == 0:
+            del lines[str(product.pk)]
+        else:
+            if quantity > product.stock:
+                raise ValueError(f'Not enough stock. Available: {product.stock}')
+            line.update(quantity=quantity, updated_at=timezone.now())
+        self._write()
+
+    def apply_batch(self, operations, products):
+        lines = self._read()['items']
+        quantities = plan_batch(
+            {int(pk): line['quantity'] for pk, line in lines.items()}, operations, products
+        )
+
+        now = timezone.now()
+        for product_id in list(lines):
+            if int(product_id) not in quantities:
+                del lines[product_id]
+        for product_id, quantity in quantities.items():
+            line = lines.get(str(product_id))
+            if line is None:
+                lines[str(product_id)] = {
+                    'quantity': quantity,
+                    'unit_price': products[product_id].price,
+                    'added_at': now,
+                    'updated_at': now,
+                }
+            elif line['quantity'] != quantity:
+                line.update(quantity=quantity, updated_at=now)
+        self._write()
+
+    def clear(self):
+        if self._read()['items']:
+            self._data['items'] = {}
+            self._write()
+
+    def totals(self):
+        lines = self._read()['items'].values()
+        return (
+            sum(line['quantity'] for line in lines),
+            sum((line['quantity'] * line['unit_price'] for line in lines), Decimal('0.00')),
+        )
+
+    def _etag_prefix(self, data):
+        """Cart token and entry nonce, so an ETag never matches another or a recreated cart"""
+        token = hashlib.sha256(self.token.encode()).hexdigest()[:12]
+        nonce = data.get('nonce') or f"{data['created_at'].timestamp():.6f}"
+        return f"{token}-{nonce}"
+
+    def summary(self):
+        data = self.cache.get(self._key()) if self.token else None
+        if data is None:
+            return None
+        self._data = data
+        count, total_amount = self.totals()
+        return {
+            'etag': f"guest-{self._etag_prefix(data)}-{data.get('version', 0)}",
+            'count': count,
+            'total_amount': total_amount,
+            'items_count': len(data['items']),
+        }
+
+    def materialize(self, cart):
+        if not self.token:
+            return
+        cart.merge_lines({
+            int(product_id): (line['quantity'], line['unit_price'])
+            for product_id, line in self._read()['items'].items()
+        })
+        self.cache.delete(self._key())
+        self._discarded = True
+
+    def finalize_response(self, response):
+        if self._discarded:
+            response.delete_cookie(settings.CART_COOKIE_NAME)
+        elif self._written:
+            # Sliding expiry: the cookie lives as long as the cache entry
+            response.set_cookie(
+                settings.CART_COOKIE_NAME,
+                self.token,
+                max_age=settings.CART_GUEST_TTL,
+                httponly=True,
+                samesite='Lax'
+            )
+
+
+def get_guest_storage(request):
+    return import_string(settings.CART_GUEST_STORAGE)(request)
+
+
+def get_cart_storage(request, materialize=True):
+    """
+    Storage for the cart of this request.
+
+    Signed-in users always use the database; a guest cart still held by
+    the guest backend is materialized into their cart first, unless
+    `materialize` is off (read-only callers).
+    """
+    if not request.user.is_authenticated:
+        return get_guest_storage(request)
+
+    guest = get_guest_storage(request)
+    storage = DatabaseCartStorage(request, guest=guest)
+    if materialize:
+        storage.materialize_guest()
+    return storage
+
+
+def merge_guest_cart(request, user):
+    """
+    Fold the guest cart of a request into the cart of the user signing in.
+
+    Runs on session and JWT login. The user row is locked for the duration,
+    so concurrent sign-ins of the same user (e.g. from two devices) merge
+    one after the other instead of racing for the same cart. Returns the
+    user's cart, or None when there was no guest cart to merge.
+    """
+    # The incoming cookie still names the pre-login session; login() rotates the key
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME) or request.session.session_key
+    guest = get_guest_storage(request)
+    if not session_key and not guest.token:
+        return None
+
+    with transaction.atomic():
+        list(type(user).objects.select_for_update().filter(pk=user.pk).values_list('pk'))
+
+        session_cart = None
+        if session_key:
+            session_cart = Cart.objects.filter(
+                session_key=session_key,
+                is_active=True,
+                user__isnull=True
+            ).first()
+        if session_cart is None and not guest.token:
+            return None
+        cart = Cart.objects.filter(user=user, is_active=True).first()
+
+        if cart is None and session_cart is not None:
+            # Nothing to merge into: the session cart becomes the user cart
+            session_cart.user = user
+            session_cart.save(update_fields=['user', 'updated_at'])
+            cart, session_cart = session_cart, None
+        elif cart is None:
+            cart = Cart.objects.create(user=user)
+
+        if session_cart is not None:
+            cart.merge_lines({
+                product_id: (quantity, unit_price)
+                for product_id, quantity, unit_price in session_cart.items
+                .values_list('product_id', 'quantity', 'unit_price')
+            })
+            session_cart.delete()
+
+        guest.materialize(cart)
+    return cart
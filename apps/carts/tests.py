@@ -1 +1,579 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.catalog.models import Product
+from apps.orders.models import Order
+from .models import Cart, CartItem
+from .reaper import _keyset_batches, abandoned_carts
+from .storage import merge_guest_cart
+
+
+class CartTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.pen = self.create_product('PEN', price='1.50', stock=100)
+        self.book = self.create_product('BOOK', price='20.00', stock=5)
+
+    def create_product(self, sku, price, stock):
+        return Product.objects.create(sku=sku, slug=sku.lower(), name=sku, price=Decimal(price), stock=stock)
+
+    def post(self, action, data=None):
+        return self.client.post(f'/api/carts/carts/{action}/', data or {}, format='json')
+
+
+class CartTotalsTests(CartTestMixin, TestCase):
+    """Stored cart totals follow every item write"""
+
+    def assertTotals(self, amount, items, lines):
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(
+            (cart.total_amount, cart.total_items, cart.line_count), (Decimal(amount), items, lines)
+        )
+        self.assertEqual(
+            cart.computed_totals(),
+            {'total_amount': Decimal(amount), 'total_items': items, 'line_count': lines}
+        )
+
+    def test_mutations_keep_totals(self):
+        response = self.post('add_item', {'product': self.pen.pk, 'quantity': 4})
+        self.assertEqual(response.data['total_amount'], '6.00')
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        self.assertTotals('29.00', 7, 2)
+
+        response = self.post('update_item', {'product': self.book.pk, 'quantity': 3})
+        self.assertEqual(response.data['items_count'], 2)
+        self.assertTotals('69.00', 9, 2)
+
+        self.post('remove_item', {'product': self.pen.pk})
+        self.assertTotals('60.00', 3, 1)
+
+        response = self.post('clear')
+        self.assertEqual(response.data['total_items'], 0)
+        self.assertTotals('0.00', 0, 0)
+
+    def test_bulk_delete_adjusts_totals(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        CartItem.objects.filter(product=self.book).delete()
+        self.assertTotals('3.00', 2, 1)
+
+    def test_count_is_single_row_read(self):
+        self.post('add_item', {'product': self.book.pk, 'quantity': 2})
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/carts/carts/count/')
+        self.assertEqual(response.data, {'count': 2, 'total_amount': Decimal('40.00')})
+
+    def test_reconcile_repairs_drift(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        Cart.objects.update(total_amount=Decimal('99.00'), line_count=7)
+
+        out = StringIO()
+        call_command('reconcile_cart_totals', stdout=out)
+        self.assertIn('1 carts drifted', out.getvalue())
+        self.assertEqual(Cart.objects.get().total_amount, Decimal('99.00'))
+
+        version = Cart.objects.get().version
+        call_command('reconcile_cart_totals', '--fix', stdout=StringIO())
+        self.assertTotals('3.00', 2, 1)
+        # Summary ETags must change with the repaired totals
+        self.assertEqual(Cart.objects.get().version, version + 1)
+
+
+class GuestCartStorageTests(CartTestMixin, TestCase):
+    """Guest carts live in the cache backend until the guest signs in"""
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.CART_CACHE_ALIAS].clear()
+        self.client = APIClient()
+
+    def test_guest_cart_writes_no_rows(self):
+        self.assertEqual(self.client.get('/api/carts/carts/current/').data['items'], [])
+
+        response = self.post('add_item', {'product': self.pen.pk, 'quantity': 4})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_amount'], '6.00')
+        self.assertEqual(response.cookies[settings.CART_COOKIE_NAME]['max-age'], settings.CART_GUEST_TTL)
+
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        response = self.post('update_item', {'product': self.pen.pk, 'quantity': 2})
+        self.assertEqual([item['quantity'] for item in response.data['items']], [2, 1])
+        self.assertEqual((response.data['total_items'], response.data['items_count']), (3, 2))
+
+        self.assertEqual(self.post('add_item', {'product': self.book.pk, 'quantity': 5}).status_code, 400)
+        self.assertEqual(self.post('remove_item', {'product': self.pen.pk}).data['total_amount'], '20.00')
+        self.assertEqual(self.post('remove_item', {'product': self.pen.pk}).status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/carts/carts/count/').data,
+            {'count': 1, 'total_amount': Decimal('20.00')}
+        )
+        self.assertEqual(self.post('clear').data['total_items'], 0)
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+    def test_evicted_cart_is_empty(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 1})
+        caches[settings.CART_CACHE_ALIAS].clear()
+        self.assertEqual(self.client.get('/api/carts/carts/current/').data['total_items'], 0)
+
+    def test_same_contract_as_database_backend(self):
+        guest = self.post('add_item', {'product': self.pen.pk, 'quantity': 2}).data
+
+        with override_settings(CART_GUEST_STORAGE='apps.carts.storage.DatabaseCartStorage'):
+            stored = APIClient().post(
+                '/api/carts/carts/add_item/', {'product': self.pen.pk, 'quantity': 2}, format='json'
+            ).data
+
+        self.assertEqual(set(guest), set(stored))
+        self.assertEqual(set(guest['items'][0]), set(stored['items'][0]))
+        for field in ['total_amount', 'total_items', 'items_count']:
+            self.assertEqual(guest[field], stored[field])
+
+    def test_materialized_on_sign_in(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.book, quantity=1, unit_price=self.book.price)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/carts/carts/current/')
+
+        self.assertEqual(response.data['id'], cart.pk)
+        self.assertEqual(response.data['total_amount'], '23.00')
+        self.assertEqual(response.cookies[settings.CART_COOKIE_NAME].value, '')
+        self.assertEqual(len(caches[settings.CART_CACHE_ALIAS]._cache), 0)
+
+
+class BatchCartTests(CartTestMixin, TestCase):
+    """POST /carts/batch/ applies many operations with set-based writes"""
+
+    def batch(self, operations, client=None):
+        return (client or self.client).post(
+            '/api/carts/carts/batch/', {'operations': operations}, format='json'
+        )
+
+    def test_operations_apply_in_order(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 1})
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        mug = self.create_product('MUG', price='8.00', stock=10)
+
+        response = self.batch([
+            {'op': 'add', 'product': self.pen.pk, 'quantity': 3},
+            {'op': 'remove', 'product': self.book.pk},
+            {'op': 'set', 'product': mug.pk, 'quantity': 2},
+            {'op': 'add', 'product': mug.pk},
+        ])
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [(item['product'], item['quantity']) for item in response.data['items']],
+            [(self.pen.pk, 4), (mug.pk, 3)]
+        )
+        self.assertEqual(response.data['total_amount'], '30.00')
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(
+            cart.computed_totals(),
+            {'total_amount': cart.total_amount, 'total_items': 7, 'line_count': 2}
+        )
+
+    def test_stock_checked_for_all_lines(self):
+        scarce = self.create_product('SCARCE', price='3.00', stock=1)
+        response = self.batch([
+            {'op': 'set', 'product': self.book.pk, 'quantity': 6},
+            {'op': 'add', 'product': self.pen.pk, 'quantity': 2},
+            {'op': 'add', 'product': scarce.pk, 'quantity': 2},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([s['sku'] for s in response.data['shortfalls']], ['BOOK', 'SCARCE'])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_unknown_product(self):
+        response = self.batch([{'op': 'add', 'product': 9999}])
+        self.assertEqual(response.data['products'], [9999])
+
+    def test_inactive_product_can_only_shrink(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 3})
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        Product.objects.filter(pk__in=[self.pen.pk, self.book.pk]).update(is_active=False)
+
+        response = self.batch([{'op': 'add', 'product': self.pen.pk}])
+        self.assertEqual((response.status_code, response.data['products']), (400, [self.pen.pk]))
+
+        response = self.batch([
+            {'op': 'set', 'product': self.pen.pk, 'quantity': 1},
+            {'op': 'remove', 'product': self.book.pk},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([(item['product'], item['quantity']) for item in response.data['items']], [(self.pen.pk, 1)])
+
+    def test_queries_do_not_grow_with_lines(self):
+        def sync(lines):
+            products = [self.create_product(f'P{lines}-{i}', price='2.00', stock=10) for i in range(lines)]
+            operations = [{'op': 'set', 'product': product.pk, 'quantity': 3} for product in products]
+            CartItem.objects.all().delete()
+            self.batch([{'op': 'add', 'product': product.pk} for product in products[::2]])
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.batch(operations)
+            self.assertEqual(response.data['total_items'], 3 * lines)
+            return len(ctx.captured_queries)
+
+        queries = sync(3)
+        self.assertEqual(queries, sync(30))
+        self.assertLessEqual(queries, 15)
+
+    def test_guest_batch(self):
+        caches[settings.CART_CACHE_ALIAS].clear()
+        guest = APIClient()
+        response = self.batch([
+            {'op': 'add', 'product': self.pen.pk, 'quantity': 2},
+            {'op': 'set', 'product': self.book.pk, 'quantity': 1},
+        ], client=guest)
+
+        self.assertEqual((response.data['total_amount'], response.data['items_count']), ('23.00', 2))
+        self.assertFalse(Cart.objects.exists())
+
+
+class CartMergeTests(CartTestMixin, TestCase):
+    """Guest carts are merged into the user's cart on sign-in"""
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.CART_CACHE_ALIAS].clear()
+        self.user.set_password('pass')
+        self.user.save()
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.pen, quantity=2, unit_price=Decimal('1.00'))
+        self.guest = Cart.objects.create(session_key='guest-session')
+        CartItem.objects.create(cart=self.guest, product=self.pen, quantity=3, unit_price=self.pen.price)
+        CartItem.objects.create(cart=self.guest, product=self.book, quantity=4, unit_price=self.book.price)
+        self.client = APIClient()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'guest-session'
+
+    def assertMerged(self):
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(
+            dict(cart.items.values_list('product__sku', 'quantity')), {'PEN': 5, 'BOOK': 4}
+        )
+        # The user's earlier price snapshot is kept for lines they already had
+        self.assertEqual(cart.items.get(product=self.pen).subtotal, Decimal('5.00'))
+        self.assertEqual(
+            (cart.total_amount, cart.total_items, cart.line_count), (Decimal('85.00'), 9, 2)
+        )
+        self.assertFalse(Cart.objects.filter(pk=self.guest.pk).exists())
+
+    def test_jwt_login_merges(self):
+        response = self.client.post('/api/token/', {'username': 'buyer', 'password': 'pass'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.assertMerged()
+
+    def test_session_login_merges(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.post('/admin/login/', {'username': 'buyer', 'password': 'pass'})
+        self.assertMerged()
+
+    def test_quantities_clamped_to_stock(self):
+        CartItem.objects.filter(cart=self.guest, product=self.book).update(quantity=9)
+        self.client.post('/api/token/', {'username': 'buyer', 'password': 'pass'}, format='json')
+        self.assertEqual(Cart.objects.get(user=self.user).items.get(product=self.book).quantity, 5)
+
+    def test_cached_guest_cart_merges(self):
+        guest = APIClient()
+        guest.post('/api/carts/carts/add_item/', {'product': self.book.pk, 'quantity': 2}, format='json')
+        guest.post('/api/token/', {'username': 'buyer', 'password': 'pass'}, format='json')
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(cart.items.values_list('product__sku', 'quantity')), {'PEN': 2, 'BOOK': 2})
+        self.assertEqual(cart.total_amount, Decimal('42.00'))
+
+    def test_merge_returns_the_user_cart(self):
+        request = RequestFactory().post('/api/token/')
+        request.session = SessionBase()
+        self.assertIsNone(merge_guest_cart(request, self.user))
+
+        guest = Cart.objects.create(session_key='merge-return')
+        CartItem.objects.create(cart=guest, product=self.pen, quantity=1, unit_price=self.pen.price)
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = guest.session_key
+        self.assertEqual(merge_guest_cart(request, self.user), Cart.objects.get(user=self.user, is_active=True))
+
+    def test_merge_queries_do_not_grow_with_lines(self):
+        def merge(lines):
+            products = [self.create_product(f'M{lines}-{i}', price='1.00', stock=10) for i in range(lines)]
+            guest = Cart.objects.create(session_key=f'merge-{lines}')
+            for product in products:
+                CartItem.objects.create(cart=guest, product=product, quantity=1, unit_price=product.price)
+            request = RequestFactory().post('/api/token/')
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = guest.session_key
+            request.session = SessionBase()
+            with CaptureQueriesContext(connection) as ctx:
+                merge_guest_cart(request, self.user)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(merge(3), merge(100))
+
+
+class ConcurrentCartMergeTests(CartTestMixin, TransactionTestCase):
+    """Two devices signing in at once must end up with one merged cart"""
+
+    def test_concurrent_logins(self):
+        sessions = []
+        for name, product in [('phone', self.pen), ('laptop', self.book)]:
+            guest = Cart.objects.create(session_key=name)
+            CartItem.objects.create(cart=guest, product=product, quantity=1, unit_price=product.price)
+            sessions.append(name)
+        start = threading.Barrier(2)
+
+        def login(session_key):
+            request = RequestFactory().post('/api/token/')
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+            request.session = SessionBase()
+            start.wait()
+            try:
+                while True:
+                    try:
+                        merge_guest_cart(request, self.user)
+                        break
+                    except OperationalError:
+                        # SQLite reports writer contention instead of blocking; retry
+                        continue
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=login, args=(key,)) for key in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(cart.items.values_list('product__sku', 'quantity')), {'PEN': 1, 'BOOK': 1})
+        self.assertEqual((cart.total_items, cart.line_count), (2, 2))
+        self.assertFalse(Cart.objects.filter(user__isnull=True).exists())
+
+
+class AbandonedCartReaperTests(CartTestMixin, TestCase):
+    """reap_abandoned_carts removes idle guest/inactive carts and expired sessions"""
+
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=45)
+        self.active = Cart.objects.create(user=self.user)
+        self.abandoned = []
+        for i in range(5):
+            cart = Cart.objects.create(session_key=f'guest-{i}')
+            CartItem.objects.create(cart=cart, product=self.pen, quantity=1, unit_price=self.pen.price)
+            self.abandoned.append(cart.pk)
+        self.fresh = Cart.objects.create(session_key='fresh')
+        retired = Cart.objects.create(user=self.user, is_active=False)
+        self.abandoned.append(retired.pk)
+        Cart.objects.filter(pk__in=self.abandoned + [self.active.pk]).update(updated_at=old)
+        Session.objects.create(session_key='gone', session_data='', expire_date=old)
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1))
+
+    def test_dry_run_only_counts(self):
+        out = StringIO()
+        call_command('reap_abandoned_carts', '--dry-run', '--batch-size', '4', stdout=out)
+        self.assertIn('Would delete 6 carts (5 items) and 1 expired sessions, in about 2 cart batches', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 8)
+
+    def test_deletes_in_chunks(self):
+        out = StringIO()
+        call_command('reap_abandoned_carts', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Deleted 6 carts (5 items) and 1 expired sessions', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {self.active.pk, self.fresh.pk})
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+    def test_batches_follow_updated_at_and_id(self):
+        batches = list(_keyset_batches(abandoned_carts(), 4))
+        self.assertEqual([len(rows) for rows in batches], [4, 2])
+        self.assertEqual(sorted(pk for rows in batches for pk, _ in rows), sorted(self.abandoned))
+
+
+class CartRepricingTests(CartTestMixin, TestCase):
+    """Lines follow the current product price on `current` and at checkout"""
+
+    def test_current_reprices_and_flags(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        self.post('add_item', {'product': self.book.pk, 'quantity': 1})
+        Product.objects.filter(pk=self.pen.pk).update(price=Decimal('2.00'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/carts/carts/current/')
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]), 2)
+
+        pen, book = response.data['items']
+        self.assertEqual((pen['price_changed'], pen['previous_unit_price'], pen['unit_price']), (True, '1.50', '2.00'))
+        self.assertEqual((book['price_changed'], book['previous_unit_price']), (False, None))
+        self.assertEqual(response.data['total_amount'], '24.00')
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.computed_totals()['total_amount'], cart.total_amount)
+
+        response = self.client.get('/api/carts/carts/current/')
+        self.assertFalse(response.data['items'][0]['price_changed'])
+
+    def test_checkout_charges_current_price(self):
+        self.post('add_item', {'product': self.book.pk, 'quantity': 2})
+        Product.objects.filter(pk=self.book.pk).update(price=Decimal('18.00'))
+
+        url, data = '/api/orders/orders/create_from_cart/', {'shipping_address': '1 Main St'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 409)
+        [item] = response.data['changed_items']
+        self.assertEqual((item['previous_unit_price'], item['unit_price']), ('20.00', '18.00'))
+        self.assertFalse(Order.objects.exists())
+
+        # Checking out again accepts the new prices
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_amount'], '36.00')
+
+    def test_guest_cart_reprices(self):
+        caches[settings.CART_CACHE_ALIAS].clear()
+        guest = APIClient()
+        guest.post('/api/carts/carts/add_item/', {'product': self.pen.pk, 'quantity': 2}, format='json')
+        Product.objects.filter(pk=self.pen.pk).update(price=Decimal('1.00'))
+
+        item = guest.get('/api/carts/carts/current/').data['items'][0]
+        self.assertEqual((item['price_changed'], item['previous_unit_price']), (True, '1.50'))
+        self.assertEqual(guest.get('/api/carts/carts/count/').data['total_amount'], Decimal('2.00'))
+
+    def test_save_without_product_fetch(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 4})
+        item = CartItem.objects.get()
+
+        with CaptureQueriesContext(connection) as ctx:
+            item.quantity = 1  # shrinking needs no stock check
+            item.save()
+            item.product = self.pen  # growing uses the product the caller holds
+            item.quantity = 6
+            item.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "catalog_product"' in q['sql']])
+        self.assertEqual(Cart.objects.get().total_items, 6)
+
+
+class CartRenderQueryTests(CartTestMixin, TestCase):
+    """Cart responses cost the same number of queries whatever the number of lines"""
+
+    # Cart row, items joined with products, and the two catalog listing prefetches
+    RENDER_QUERIES = 4
+
+    def fill(self, lines):
+        cart = Cart.objects.create(user=self.user)
+        products = Product.objects.bulk_create([
+            Product(sku=f'L{lines}-{i}', slug=f'l{lines}-{i}', name=f'Line {i}', price=Decimal('2.00'), stock=10)
+            for i in range(lines)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=p, quantity=1, unit_price=p.price, subtotal=p.price) for p in products
+        ])
+        cart.recompute_totals()
+        return cart
+
+    def test_current(self):
+        for lines in [1, 10, 100]:
+            with self.subTest(lines=lines):
+                cart = self.fill(lines)
+                with self.assertNumQueries(self.RENDER_QUERIES):
+                    response = self.client.get('/api/carts/carts/current/')
+                self.assertEqual(len(response.data['items']), lines)
+                self.assertEqual(response.data['total_amount'], f'{2 * lines}.00')
+                cart.delete()
+
+    def test_mutation_responses(self):
+        counts = set()
+        for lines in [1, 10, 100]:
+            cart = self.fill(lines)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.post('update_item', {'product': cart.items.first().product_id, 'quantity': 3})
+            self.assertEqual(response.data['total_items'], lines + 2)
+            self.assertEqual(response.data['items_count'], lines)
+            counts.add(len(ctx.captured_queries))
+            cart.delete()
+        self.assertEqual(len(counts), 1)
+
+
+class CartSummaryTests(CartTestMixin, TestCase):
+    """GET /carts/summary/ is a conditional, state-free read"""
+
+    url = '/api/carts/carts/summary/'
+
+    def test_etag_and_not_modified(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data, {'count': 2, 'total_amount': Decimal('3.00'), 'items_count': 1})
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 1})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_version_follows_every_item_write(self):
+        self.post('add_item', {'product': self.pen.pk, 'quantity': 2})
+        self.post('update_item', {'product': self.pen.pk, 'quantity': 1})
+        self.post('batch', {'operations': [{'op': 'add', 'product': self.book.pk}]})
+        self.post('clear')
+        self.assertEqual(Cart.objects.get(user=self.user).version, 4)
+
+    def test_never_creates_state(self):
+        caches[settings.CART_CACHE_ALIAS].clear()
+        guest = APIClient()
+        response = guest.get(self.url)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response['ETag'], '"empty"')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 0)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+    def test_guest_etag_changes_when_cart_is_recreated(self):
+        cache = caches[settings.CART_CACHE_ALIAS]
+        cache.clear()
+        guest = APIClient()
+        guest.post('/api/carts/carts/add_item/', {'product': self.book.pk, 'quantity': 1}, format='json')
+        etag = guest.get(self.url)['ETag']
+
+        # Evicted, then started again under the same cookie: version is back at 1
+        cache.clear()
+        guest.post('/api/carts/carts/add_item/', {'product': self.pen.pk, 'quantity': 1}, format='json')
+        response = guest.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['total_amount'], Decimal('1.50'))
+
+    def test_guest_summary_from_cache(self):
+        caches[settings.CART_CACHE_ALIAS].clear()
+        guest = APIClient()
+        guest.post('/api/carts/carts/add_item/', {'product': self.book.pk, 'quantity': 1}, format='json')
+
+        with self.assertNumQueries(0):
+            response = guest.get(self.url)
+        self.assertEqual(response.data['total_amount'], Decimal('20.00'))
+        self.assertEqual(guest.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
@@ -3,13 +3,20 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from decimal import Decimal
+from django.db.models import Prefetch
+from django.utils.http import parse_etags, quote_etag
+from apps.catalog.models import listing_prefetches
+from apps.catalog.stock import InsufficientStock
 from .models import Cart, CartItem
+from .storage import CartItemNotFound, ProductUnavailable, get_cart_storage
 from .serializers import (
     CartSerializer,
     CartItemSerializer,
     AddToCartSerializer,
     UpdateCartItemSerializer,
     RemoveFromCartSerializer,
+    BatchCartSerializer,
 )
 
 
@@ -23,94 +30,50 @@ class CartViewSet(viewsets.ModelViewSet):
         session_key = self.request.session.session_key
         
         if user.is_authenticated:
-            return Cart.objects.filter(user=user, is_active=True)
+            queryset = Cart.objects.filter(user=user, is_active=True)
         else:
-            if session_key:
-                return Cart.objects.filter(session_key=session_key, is_active=True)
-            return Cart.objects.none()
-
-    def get_or_create_cart(self):
-        """Get or create cart for current user/session"""
-        user = self.request.user
-        session_key = self.request.session.session_key
-
-        if user.is_authenticated:
-            # First try to find existing cart for user
-            cart = Cart.objects.filter(user=user, is_active=True).first()
-            if cart:
-                return cart
-            
-            # If no user cart, check for session cart and merge
-            if session_key:
-                session_cart = Cart.objects.filter(
-                    session_key=session_key, 
-                    is_active=True,
-                    user__isnull=True
-                ).first()
-                
-                if session_cart:
-                    # Convert session cart to user cart
-                    session_cart.user = user
-                    session_cart.save()
-                    return session_cart
-            
-            # Create new user cart
-            cart = Cart.objects.create(user=user)
-        else:
-            # Guest user
             if not session_key:
-                self.request.session.create()
-                session_key = self.request.session.session_key
-            
-            cart, created = Cart.objects.get_or_create(
-                session_key=session_key,
-                is_active=True,
-                user__isnull=True
-            )
-        
-        return cart
+                return Cart.objects.none()
+            queryset = Cart.objects.filter(session_key=session_key, is_active=True)
+
+        return queryset.prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.select_related('product')),
+            *listing_prefetches('items__product__')
+        )
+
+    def get_storage(self):
+        """Cart storage backend for the current user/session"""
+        if not hasattr(self, '_storage'):
+            self._storage = get_cart_storage(self.request)
+        return self._storage
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if hasattr(self, '_storage'):
+            self._storage.finalize_response(response)
+        return response
+
+    def render_cart(self, status_code=status.HTTP_200_OK, reprice=False):
+        cart_serializer = CartSerializer(self.get_storage().load(reprice=reprice))
+        return Response(cart_serializer.data, status=status_code)
 
     @action(detail=False, methods=['GET'])
     def current(self, request):
-        """Get current user's cart"""
-        cart = self.get_or_create_cart()
-        serializer = self.get_serializer(cart)
-        return Response(serializer.data)
+        """Get current user's cart, repriced against current product prices"""
+        return self.render_cart(reprice=True)
 
     @action(detail=False, methods=['POST'])
     def add_item(self, request):
         """Add item to cart"""
         serializer = AddToCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
-        cart = self.get_or_create_cart()
+
         product = serializer.validated_data['product']
         quantity = serializer.validated_data['quantity']
 
         try:
-            # Check if item already exists in cart
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={
-                    'quantity': quantity,
-                    'unit_price': product.price
-                }
-            )
-
-            if not created:
-                # Update existing item
-                new_quantity = cart_item.quantity + quantity
-                if new_quantity > product.stock:
-                    return Response(
-                        {'error': f'Not enough stock. Available: {product.stock}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                cart_item.quantity = new_quantity
-                cart_item.save()
-
-            cart_serializer = CartSerializer(cart)
-            return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
+            self.get_storage().add_item(product, quantity)
+            return self.render_cart(status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response(
@@ -123,18 +86,14 @@ class CartViewSet(viewsets.ModelViewSet):
         """Remove item from cart"""
         serializer = RemoveFromCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
-        cart = self.get_or_create_cart()
+
         product = serializer.validated_data['product']
 
         try:
-            cart_item = CartItem.objects.get(cart=cart, product=product)
-            cart_item.delete()
-            
-            cart_serializer = CartSerializer(cart)
-            return Response(cart_serializer.data)
-        
-        except CartItem.DoesNotExist:
+            self.get_storage().remove_item(product)
+            return self.render_cart()
+
+        except CartItemNotFound:
             return Response(
                 {'error': 'Item not found in cart'},
                 status=status.HTTP_404_NOT_FOUND
@@ -155,53 +114,87 @@ class CartViewSet(viewsets.ModelViewSet):
         serializer = UpdateCartItemSerializer(data={'quantity': quantity})
         serializer.is_valid(raise_exception=True)
 
-        cart = self.get_or_create_cart()
-
         try:
             from apps.catalog.models import Product
             product = Product.objects.get(id=product_id)
-            cart_item = CartItem.objects.get(cart=cart, product=product)
-
-            new_quantity = serializer.validated_data['quantity']
-            
-            if new_quantity == 0:
-                cart_item.delete()
-            else:
-                if new_quantity > product.stock:
-                    return Response(
-                        {'error': f'Not enough stock. Available: {product.stock}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                cart_item.quantity = new_quantity
-                cart_item.save()
-
-            cart_serializer = CartSerializer(cart)
-            return Response(cart_serializer.data)
-
-        except (Product.DoesNotExist, CartItem.DoesNotExist):
+            self.get_storage().update_item(product, serializer.validated_data['quantity'])
+            return self.render_cart()
+
+        except (Product.DoesNotExist, CartItemNotFound):
             return Response(
                 {'error': 'Item not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except ValueError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    @action(detail=False, methods=['POST'])
+    def batch(self, request):
+        """Apply several add/set/remove operations and return the cart once"""
+        serializer = BatchCartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        from apps.catalog.models import Product
+        product_ids = {operation['product'] for operation in operations}
+        # Inactive products are loaded too, so their lines can still be shrunk or removed
+        products = Product.objects.with_listing_data().in_bulk(product_ids)
+        missing = sorted(product_ids - set(products))
+        if missing:
+            return Response(
+                {'error': 'Products not available', 'products': missing},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            self.get_storage().apply_batch(operations, products)
+            return self.render_cart()
+
+        except ProductUnavailable as e:
+            return Response(
+                {'error': 'Products not available', 'products': e.products},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except InsufficientStock as e:
+            return Response(
+                {'error': 'Not enough stock', 'shortfalls': e.shortfalls},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
     @action(detail=False, methods=['POST'])
     def clear(self, request):
         """Clear all items from cart"""
-        cart = self.get_or_create_cart()
-        cart.clear()
-        
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        self.get_storage().clear()
+        return self.render_cart()
 
     @action(detail=False, methods=['GET'])
     def count(self, request):
         """Get cart items count"""
-        cart = self.get_or_create_cart()
+        count, total_amount = self.get_storage().totals()
         return Response({
-            'count': cart.total_items,
-            'total_amount': cart.total_amount
+            'count': count,
+            'total_amount': total_amount
         })
 
+    @action(detail=False, methods=['GET'])
+    def summary(self, request):
+        """Get cart count and total for polling; honours If-None-Match"""
+        summary = get_cart_storage(request, materialize=False).summary()
+        if summary is None:
+            summary = {'etag': 'empty', 'count': 0, 'total_amount': Decimal('0.00'), 'items_count': 0}
+        etag = quote_etag(summary.pop('etag'))
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(summary)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 
 class CartItemViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing cart items"""
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'catalog:version'
+STATS_KEY = 'catalog:stats:{name}:{outcome}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def get_version():
+    """Current catalog version, used as a namespace for every cached entry"""
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted version never reuses an old namespace
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Invalidate every cached catalog entry at once"""
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_version()
+
+
+def _record(name, outcome):
+    cache = get_cache()
+    key = STATS_KEY.format(name=name, outcome=outcome)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_or_compute(name, compute, timeout=None):
+    """Return the cached value for `name`, computing and storing it on a miss"""
+    cache = get_cache()
+    key = f'catalog:{get_version()}:{name}'
+    # Counters are kept per entry kind, e.g. "facets:<digest>" counts as "facets"
+    kind = name.split(':', 1)[0]
+    value = cache.get(key)
+    if value is not None:
+        _record(kind, 'hits')
+        return value
+
+    _record(kind, 'misses')
+    value = compute()
+    if timeout is None:
+        timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+    cache.set(key, value, timeout)
+    return value
+
+
+def get_stats(names):
+    """Hit/miss counters for the given cache entry names"""
+    cache = get_cache()
+    stats = {}
+    for name in names:
+        stats[name] = {
+            outcome: cache.get(STATS_KEY.format(name=name, outcome=outcome), 0)
+            for outcome in ('hits', 'misses')
+        }
+    return stats
@@ -0,0 +1,75 @@
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from . import cache as catalog_cache
+from .models import Category, Product
+from .search import tokenize
+
+FACET_PARAMS = ['q', 'category', 'min_price', 'max_price', 'in_stock']
+
+
+def facet_key(params):
+    """
+    Normalized cache key for a search request, ignoring pagination, case and
+    term order or repetition (every term must match, in any order)
+    """
+    normalized = []
+    for name in FACET_PARAMS:
+        value = params.get(name, '').strip()
+        if name == 'q':
+            value = ' '.join(sorted(set(tokenize(value))))
+        normalized.append(f'{name}={value}')
+    digest = hashlib.md5('&'.join(normalized).encode()).hexdigest()
+    return f'facets:{digest}'
+
+
+def price_bands():
+    bounds = list(getattr(settings, 'CATALOG_PRICE_BANDS', [25, 50, 100, 200]))
+    lower = [0] + bounds
+    upper = bounds + [None]
+    return list(zip(lower, upper))
+
+
+def compute_facets(products):
+    """
+    Category, price band and availability counts for an already-filtered
+    product queryset: one conditional aggregate plus one grouped query.
+    """
+    matched = Product.objects.filter(pk__in=products.values('pk'))
+    bands = price_bands()
+
+    aggregates = {'in_stock': Count('id', filter=Q(stock__gt=0)), 'total': Count('id')}
+    for index, (low, high) in enumerate(bands):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'band_{index}'] = Count('id', filter=condition)
+    totals = matched.aggregate(**aggregates)
+
+    categories = Category.objects.filter(
+        is_active=True,
+        products__in=matched,
+    ).values('slug', 'name').annotate(count=Count('products')).order_by('-count', 'name')
+
+    return {
+        'categories': list(categories),
+        'price': [
+            {'min': low, 'max': high, 'count': totals[f'band_{index}']}
+            for index, (low, high) in enumerate(bands)
+        ],
+        'availability': {
+            'in_stock': totals['in_stock'],
+            'out_of_stock': totals['total'] - totals['in_stock'],
+        },
+    }
+
+
+def get_facets(products, params):
+    """Facet counts for a search request, cached by its normalized query"""
+    return catalog_cache.get_or_compute(
+        facet_key(params),
+        lambda: compute_facets(products),
+        timeout=getattr(settings, 'CATALOG_FACETS_CACHE_TIMEOUT', 60),
+    )
@@ -0,0 +1,67 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.catalog.models import Product
+from apps.catalog.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Benchmark product search latency against a synthetic catalog (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [f'{rng.choice("bcdfghklmnprstvz")}{rng.choice("aeiou")}{i:x}' for i in range(20000)]
+        backend = get_backend()
+
+        with transaction.atomic():
+            self.seed(rng, vocabulary, backend, options['products'], options['batch_size'])
+
+            queries = [
+                ' '.join(rng.sample(vocabulary, rng.choice([1, 2])))[:-1]  # prefix of the last word
+                for _ in range(options['queries'])
+            ]
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                list(
+                    backend.search(Product.objects.filter(is_active=True), query)
+                    .order_by('search_rank').values_list('id', flat=True)[:20]
+                )
+                timings.append((time.perf_counter() - start) * 1000)
+
+            transaction.set_rollback(True)
+
+        timings.sort()
+        self.stdout.write(f'Backend: {type(backend).__name__}, products: {options["products"]}')
+        self.stdout.write(
+            f'p50 {statistics.median(timings):.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, '
+            f'max {timings[-1]:.2f} ms'
+        )
+
+    def seed(self, rng, vocabulary, backend, total, batch_size):
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            products = [
+                Product(
+                    sku=f'BENCH-{i}',
+                    slug=f'bench-{i}',
+                    name=' '.join(rng.sample(vocabulary, 3)),
+                    description=' '.join(rng.sample(vocabulary, 12)),
+                    price=rng.randint(100, 100000) / 100,
+                    stock=rng.randint(0, 50),
+                )
+                for i in range(offset, min(offset + batch_size, total))
+            ]
+            backend.index(Product.objects.bulk_create(products))
+        self.stdout.write(f'Seeded {total} products in {time.perf_counter() - start:.1f} s')
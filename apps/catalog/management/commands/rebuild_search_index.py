@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.catalog.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {type(backend).__name__}'))
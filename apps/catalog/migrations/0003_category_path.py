@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:17
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    categories = list(Category.objects.order_by('pk'))
+    by_id = {category.pk: category for category in categories}
+
+    def resolve(category):
+        if category.path:
+            return category
+        if category.parent_id is None:
+            category.path, category.depth = f"{category.pk}/", 0
+        else:
+            parent = resolve(by_id[category.parent_id])
+            category.path = f"{parent.path}{category.pk}/"
+            category.depth = parent.depth + 1
+        return category
+
+    for category in categories:
+        resolve(category)
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_alter_category_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Depth'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='Path'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE catalog_product_fts USING fts5("
+            "name, description, sku, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO catalog_product_fts (rowid, name, description, sku) "
+            "SELECT id, name, description, sku FROM catalog_product"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE catalog_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES catalog_product (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX catalog_product_search_document_idx "
+            "ON catalog_product_search USING GIN (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO catalog_product_search (product_id, document) "
+            "SELECT id, setweight(to_tsvector('simple', sku), 'A') || "
+            "setweight(to_tsvector('simple', name), 'A') || "
+            "setweight(to_tsvector('simple', description), 'B') FROM catalog_product"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS catalog_product_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS catalog_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_category_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
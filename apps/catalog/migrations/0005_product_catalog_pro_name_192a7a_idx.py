@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='catalog_pro_name_192a7a_idx'),
+        ),
+    ]
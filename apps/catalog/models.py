@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
+from . import cache as catalog_cache
 
 class Category(models.Model):
     name = models.CharField('Name', max_length=150, unique=True)
@@ -12,6 +15,9 @@ class Category(models.Model):
         verbose_name='Father category'
     )
     is_active = models.BooleanField('Is active', default=True)
+    # Materialized path of primary keys from the root, e.g. "1/4/9/"
+    path = models.CharField('Path', max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField('Depth', default=0, editable=False)
     created_at = models.DateTimeField('Created at', auto_now_add=True)
     updated_at = models.DateTimeField('Updated at', auto_now=True)
 
@@ -23,11 +29,94 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+
+        parent = self.parent
+        if parent is not None and self.path and parent.path.startswith(self.path):
+            raise ValueError("A category cannot be moved under itself or its descendants.")
+
+        old_path = self.path
         super().save(*args, **kwargs)
+
+        new_path = f"{parent.path if parent else ''}{self.pk}/"
+        if new_path != old_path:
+            new_depth = parent.depth + 1 if parent else 0
+            if old_path:
+                # Moved: rewrite the prefix of the whole subtree in one statement
+                Category.objects.filter(path__startswith=old_path).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (new_depth - self.depth),
+                )
+            else:
+                Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+            self.path = new_path
+            self.depth = new_depth
+
+        # Only now is the node cacheable: post_save fires before its path is written
+        catalog_cache.bump_version()
+
+    def get_descendants(self, include_self=True):
+        """All categories in this subtree, without recursion"""
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+    def get_active_descendants(self):
+        """Active categories in this subtree that no inactive category of it hides"""
+        queryset = self.get_descendants().filter(is_active=True)
+        for path in self.get_descendants().filter(is_active=False).values_list('path', flat=True):
+            queryset = queryset.exclude(path__startswith=path)
+        return queryset
+
+    @staticmethod
+    def build_tree(categories):
+        """
+        Link categories (ordered parents first, e.g. by depth) into an in-memory
+        tree via `tree_children` and return the roots. Nodes whose parent is
+        not in `categories` are dropped along with their subtree.
+        """
+        nodes = {}
+        roots = []
+        for category in categories:
+            category.tree_children = []
+            if category.parent_id is None:
+                roots.append(category)
+            elif category.parent_id in nodes:
+                nodes[category.parent_id].tree_children.append(category)
+            else:
+                continue
+            nodes[category.pk] = category
+        return roots
      
     def __str__(self):
         return self.name
     
+class ProductQuerySet(models.QuerySet):
+    def with_listing_data(self):
+        """Prefetch everything ProductListSerializer reads, in a fixed number of queries"""
+        return self.prefetch_related(*listing_prefetches())
+
+
+def listing_prefetches(lookup=''):
+    """
+    Prefetch objects for the featured image and active category names of a
+    product list. `lookup` is the path to the product relation when the
+    products are reached through another model (e.g. 'items__product__').
+    """
+    return [
+        models.Prefetch(
+            f'{lookup}images',
+            queryset=ProductImage.objects.order_by('-is_featured', 'order', '-uploaded_at')[:1],
+            to_attr='listing_images',
+        ),
+        models.Prefetch(
+            f'{lookup}categories',
+            queryset=Category.objects.filter(is_active=True).only('id', 'name'),
+            to_attr='active_categories',
+        ),
+    ]
+
+
 class Product(models.Model):
     sku = models.CharField('SKU', max_length=30, unique=True)
     name = models.CharField('Name', max_length=150)
@@ -43,6 +132,9 @@ class Product(models.Model):
     )
     created_at = models.DateTimeField('Created at', auto_now_add=True)
     updated_at = models.DateTimeField('Updated at', auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
@@ -50,6 +142,7 @@ class Product(models.Model):
         indexes = [
             models.Index(fields=['sku']),
             models.Index(fields=['slug']),
+            models.Index(fields=['name', 'id']),
         ]
 
     def save(self, *args, **kwargs):
@@ -77,4 +170,33 @@ class ProductImage(models.Model):
         ordering = ['order', '-uploaded_at']
 
     def __str__(self):
-        return f"#{self.order} image - {self.product.name}"
\ No newline at end of file
+        return f"#{self.order} image - {self.product.name}"
+
+
+# Signals to keep the category cache fresh
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_category_cache(sender, **kwargs):
+    """Bump the catalog cache version when categories or their products change (Category.save bumps itself)"""
+    catalog_cache.bump_version()
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_category_cache_on_assignment(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        catalog_cache.bump_version()
+
+
+# Signals to keep the product search index in sync
+from .search import get_backend as get_search_backend
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index([instance])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
@@ -0,0 +1,188 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+class BaseSearchBackend:
+    """
+    Product search backend. `search` narrows a Product queryset to the
+    matches of `query` and annotates a `search_rank` (lower is better), so
+    any other filter can still be chained onto the result.
+    """
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def index(self, products):
+        """Add or refresh the given products in the index"""
+
+    def remove(self, product_ids):
+        """Drop the given product ids from the index"""
+
+    def rebuild(self, chunk_size=2000):
+        """Re-index every product"""
+        from .models import Product
+
+        self.clear()
+        batch = []
+        for product in Product.objects.only('id', 'name', 'description', 'sku').iterator(chunk_size=chunk_size):
+            batch.append(product)
+            if len(batch) >= chunk_size:
+                self.index(batch)
+                batch = []
+        if batch:
+            self.index(batch)
+
+    def clear(self):
+        """Empty the index"""
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Unindexed fallback using icontains scans, for databases without full-text support"""
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        condition = Q()
+        for token in tokens:
+            condition &= (
+                Q(name__icontains=token) |
+                Q(description__icontains=token) |
+                Q(sku__icontains=token)
+            )
+        return queryset.filter(condition).annotate(search_rank=Value(0))
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """Inverted index stored in the `catalog_product_fts` FTS5 table"""
+
+    table = 'catalog_product_fts'
+
+    def match_expression(self, tokens):
+        # Every token must match, each one as a prefix
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        match = self.match_expression(tokens)
+        pk = f'{queryset.model._meta.db_table}.id'
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT bm25({self.table}, 10.0, 1.0, 5.0) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = {pk}',
+                (match,)
+            )
+        )
+
+    def index(self, products):
+        rows = [(p.pk, p.name, p.description, p.sku) for p in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description, sku) VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Inverted index stored as a GIN-indexed tsvector in `catalog_product_search`"""
+
+    table = 'catalog_product_search'
+    document = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B')"
+    )
+
+    def tsquery(self, tokens):
+        return ' & '.join(f'{token}:*' for token in tokens)
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        tsquery = self.tsquery(tokens)
+        pk = f'{queryset.model._meta.db_table}.id'
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT product_id FROM {self.table} WHERE document @@ to_tsquery('simple', %s)",
+                (tsquery,)
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT -ts_rank(document, to_tsquery('simple', %s)) FROM {self.table} "
+                f"WHERE product_id = {pk}",
+                (tsquery,)
+            )
+        )
+
+    def index(self, products):
+        rows = [(p.pk, p.sku, p.name, p.description) for p in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (product_id, document) VALUES (%s, {self.document}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', (list(product_ids),))
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    """Backend from CATALOG_SEARCH_BACKEND, or the best one for the database in use"""
+    path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(connection.vendor, DatabaseSearchBackend)()
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    `?search=` filter backed by the product search index. Results are ranked
+    by relevance unless the client asks for an explicit `ordering`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        queryset = get_backend().search(queryset, query)
+        if not request.query_params.get('ordering'):
+            queryset = queryset.order_by('search_rank', 'name')
+        return queryset
@@ -33,6 +33,13 @@ class CategorySerializer(serializers.ModelSerializer):
     def get_products_count(self, obj):
         return obj.products.filter(is_active=True).count()
 
+    def validate_parent(self, value):
+        if value and self.instance and value.path.startswith(self.instance.path):
+            raise serializers.ValidationError(
+                "A category cannot be moved under itself or its descendants."
+            )
+        return value
+
 
 class CategoryTreeSerializer(serializers.ModelSerializer):
     """Hierarchical category tree serializer"""
@@ -44,7 +51,11 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'children']
 
     def get_children(self, obj):
-        children = obj.children.filter(is_active=True)
+        # Trees built by Category.build_tree() already hold their children
+        if hasattr(obj, 'tree_children'):
+            children = obj.tree_children
+        else:
+            children = obj.children.filter(is_active=True)
         return CategoryTreeSerializer(children, many=True).data
 
 
@@ -154,6 +165,11 @@ class ProductListSerializer(serializers.ModelSerializer):
         ]
 
     def get_featured_image(self, obj):
+        # Populated by Product.objects.with_listing_data(): featured image first
+        if hasattr(obj, 'listing_images'):
+            image = obj.listing_images[0] if obj.listing_images else None
+            return image.image.url if image and image.image else None
+
         featured = obj.images.filter(is_featured=True).first()
         if featured:
             return featured.image.url if featured.image else None
@@ -164,4 +180,6 @@ class ProductListSerializer(serializers.ModelSerializer):
         return obj.stock > 0
 
     def get_category_names(self, obj):
+        if hasattr(obj, 'active_categories'):
+            return [cat.name for cat in obj.active_categories]
         return [cat.name for cat in obj.categories.filter(is_active=True)]
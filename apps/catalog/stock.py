@@ -0,0 +1,90 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product
+
+
+class InsufficientStock(Exception):
+    """Raised when a reservation cannot be fully served; nothing is reserved"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__(
+            'Not enough stock for ' + ', '.join(
+                f"{item['sku']} (requested {item['requested']}, available {item['available']})"
+                for item in shortfalls
+            )
+        )
+
+
+class _Shortfall(Exception):
+    pass
+
+
+def reserve_stock(quantities):
+    """
+    Atomically decrement stock for {product_id: quantity}.
+
+    All products are decremented by one set-based UPDATE guarded by a
+    per-row `stock >= quantity` condition, so concurrent reservations can
+    never oversell. If any product falls short the whole reservation is
+    rolled back and InsufficientStock reports every short SKU.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return
+
+    requested = Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+    try:
+        with transaction.atomic():
+            # Lock the rows in primary key order first: one UPDATE over pk IN (...) locks them in
+            # scan order, so two checkouts sharing products could otherwise deadlock. SQLite
+            # has no row locks (a write locks the whole database), and reading first would
+            # only turn writer contention into busy errors there
+            if connection.features.has_select_for_update:
+                list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk'))
+            updated = Product.objects.filter(
+                pk__in=quantities,
+                stock__gte=requested,
+            ).update(stock=F('stock') - requested, updated_at=timezone.now())
+            if updated != len(quantities):
+                raise _Shortfall()
+    except _Shortfall:
+        # Stock is back to its pre-reservation state here, so it can be reported as is
+        products = Product.objects.filter(pk__in=quantities).values('pk', 'sku', 'stock')
+        available = {p['pk']: p for p in products}
+        raise InsufficientStock([
+            {
+                'product': product_id,
+                'sku': available.get(product_id, {}).get('sku'),
+                'requested': quantities[product_id],
+                'available': available.get(product_id, {}).get('stock', 0),
+            }
+            for product_id in sorted(quantities)
+            if available.get(product_id, {}).get('stock', 0) < quantities[product_id]
+        ])
+
+
+def release_stock(quantities):
+    """
+    Return previously reserved stock for {product_id: quantity}.
+
+    Every product is incremented by one set-based UPDATE of F() plus a
+    per-product CASE, so concurrent reservations and releases never lose
+    each other's changes.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return
+
+    returned = Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F('stock') + returned, updated_at=timezone.now()
+    )
@@ -1,2 +1,366 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from . import cache as catalog_cache
+from .facets import facet_key
+from .models import Category, Product, ProductImage
+
+
+class ProductListQueryCountTests(TestCase):
+    """Product list endpoints must cost a constant number of queries per page"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Shoes')
+        self.hidden = Category.objects.create(name='Hidden', is_active=False)
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='pass', is_staff=True
+        )
+
+    def create_products(self, count, offset=0):
+        for i in range(offset, offset + count):
+            product = Product.objects.create(
+                sku=f'SKU-{i}', name=f'Product {i}', price='10.00', stock=i % 5
+            )
+            product.categories.add(self.category, self.hidden)
+            ProductImage.objects.create(product=product, image=f'products/{i}-a.jpg', order=0)
+            ProductImage.objects.create(
+                product=product, image=f'products/{i}-b.jpg', order=1, is_featured=True
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def assertConstantQueries(self, url):
+        self.create_products(2)
+        small, _ = self.count_queries(url)
+        self.create_products(15, offset=2)
+        large, response = self.count_queries(url)
+        self.assertEqual(small, large)
+        return response
+
+    def test_list(self):
+        response = self.assertConstantQueries('/api/catalog/products/')
+        product = response.data['results'][0]
+        self.assertTrue(product['featured_image'].endswith('-b.jpg'))
+        self.assertEqual(product['category_names'], ['Shoes'])
+
+    def test_search(self):
+        self.assertConstantQueries('/api/catalog/products/search/?q=Product')
+
+    def test_featured(self):
+        self.assertConstantQueries('/api/catalog/products/featured/')
+
+    def test_low_stock(self):
+        self.client.force_authenticate(self.staff)
+        self.assertConstantQueries('/api/catalog/products/low_stock/')
+
+    def test_category_products(self):
+        self.assertConstantQueries(f'/api/catalog/categories/{self.category.slug}/products/')
+
+    def test_falls_back_to_first_image_without_featured(self):
+        product = Product.objects.create(sku='PLAIN', name='Plain', price='5.00')
+        ProductImage.objects.create(product=product, image='products/plain-2.jpg', order=2)
+        ProductImage.objects.create(product=product, image='products/plain-1.jpg', order=1)
+
+        response = self.client.get('/api/catalog/products/')
+        self.assertTrue(response.data['results'][0]['featured_image'].endswith('plain-1.jpg'))
+
+
+class CategoryTreeTests(TestCase):
+    """Materialized category paths and the single-query tree"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.root = Category.objects.create(name='Clothing')
+        self.men = Category.objects.create(name='Men', parent=self.root)
+        self.shirts = Category.objects.create(name='Shirts', parent=self.men)
+        cache.clear()
+
+    def test_paths_are_materialized(self):
+        self.assertEqual(self.shirts.path, f'{self.root.pk}/{self.men.pk}/{self.shirts.pk}/')
+        self.assertEqual(self.shirts.depth, 2)
+        self.assertEqual(
+            set(self.root.get_descendants(include_self=False)), {self.men, self.shirts}
+        )
+
+    def test_move_rewrites_subtree(self):
+        other = Category.objects.create(name='Outlet')
+        self.men.parent = other
+        self.men.save()
+
+        self.shirts.refresh_from_db()
+        self.assertEqual(self.shirts.path, f'{other.pk}/{self.men.pk}/{self.shirts.pk}/')
+        self.assertEqual(self.shirts.depth, 2)
+
+        self.men.parent = None
+        self.men.save()
+        self.shirts.refresh_from_db()
+        self.assertEqual(self.shirts.path, f'{self.men.pk}/{self.shirts.pk}/')
+        self.assertEqual(self.shirts.depth, 1)
+
+    def test_cannot_move_under_descendant(self):
+        self.root.parent = self.shirts
+        with self.assertRaises(ValueError):
+            self.root.save()
+
+    def test_tree_is_single_query(self):
+        Category.objects.create(name='Hidden', parent=self.root, is_active=False)
+        for i in range(20):
+            Category.objects.create(name=f'Leaf {i}', parent=self.shirts)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/catalog/categories/tree/')
+
+        self.assertEqual(len(response.data), 1)
+        men = response.data[0]['children']
+        self.assertEqual([child['name'] for child in men], ['Men'])
+        self.assertEqual(len(men[0]['children'][0]['children']), 20)
+
+    def test_products_include_subcategories(self):
+        product = Product.objects.create(sku='TEE', name='Tee', price='9.00', stock=3)
+        product.categories.add(self.shirts)
+
+        response = self.client.get(f'/api/catalog/categories/{self.root.slug}/products/')
+        self.assertEqual([p['sku'] for p in response.data['results']], ['TEE'])
+
+    def test_products_skip_subtrees_of_inactive_categories(self):
+        Category.objects.filter(pk=self.men.pk).update(is_active=False)
+        product = Product.objects.create(sku='TEE', name='Tee', price='9.00', stock=3)
+        product.categories.add(self.shirts)
+
+        response = self.client.get(f'/api/catalog/categories/{self.root.slug}/products/')
+        self.assertEqual(response.data['results'], [])
+
+    def test_products_skip_inactive_subcategories(self):
+        hidden = Category.objects.create(name='Hidden', parent=self.men, is_active=False)
+        only_hidden = Product.objects.create(sku='CAP', name='Cap', price='5.00', stock=3)
+        only_hidden.categories.add(hidden)
+        both = Product.objects.create(sku='TEE', name='Tee', price='9.00', stock=3)
+        both.categories.add(hidden, self.shirts)
+
+        response = self.client.get(f'/api/catalog/categories/{self.root.slug}/products/')
+        self.assertEqual([p['sku'] for p in response.data['results']], ['TEE'])
+
+
+class CategoryCacheTests(TestCase):
+    """Versioned cache of the category tree and popular categories"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Books')
+        self.product = Product.objects.create(sku='BOOK', name='Book', price='12.00', stock=1)
+        self.product.categories.add(self.category)
+
+    def test_hit_skips_database(self):
+        for url in ('/api/catalog/categories/tree/', '/api/catalog/categories/popular/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.data, second.data)
+
+    def test_category_change_invalidates(self):
+        self.client.get('/api/catalog/categories/tree/')
+        Category.objects.create(name='Music')
+
+        response = self.client.get('/api/catalog/categories/tree/')
+        self.assertEqual([c['name'] for c in response.data], ['Books', 'Music'])
+
+    def test_product_categories_change_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/catalog/categories/popular/').data), 1)
+        self.product.categories.clear()
+        self.assertEqual(len(self.client.get('/api/catalog/categories/popular/').data), 0)
+
+    def test_product_is_active_toggle_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/catalog/categories/popular/').data), 1)
+        self.product.is_active = False
+        self.product.save()
+        self.assertEqual(len(self.client.get('/api/catalog/categories/popular/').data), 0)
+
+        self.product.is_active = True
+        self.product.save()
+        self.assertEqual(len(self.client.get('/api/catalog/categories/popular/').data), 1)
+
+    def test_category_version_moves_after_path_is_written(self):
+        seen = []
+
+        def record(sender, instance, **kwargs):
+            seen.append((catalog_cache.get_version(), Category.objects.get(pk=instance.pk).path))
+        post_save.connect(record, sender=Category)
+        try:
+            child = Category.objects.create(name='Poetry', parent=self.category)
+        finally:
+            post_save.disconnect(record, sender=Category)
+
+        # At post_save the path is not written yet, so the version must not have moved for it
+        [(version, path)] = seen
+        self.assertEqual(path, '')
+        self.assertGreater(catalog_cache.get_version(), version)
+        response = self.client.get('/api/catalog/categories/tree/')
+        self.assertEqual(response.data[0]['children'][0]['name'], child.name)
+
+    def test_stats(self):
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='pass', is_staff=True
+        )
+        self.client.get('/api/catalog/categories/tree/')
+        self.client.get('/api/catalog/categories/tree/')
+
+        self.client.force_authenticate(staff)
+        response = self.client.get('/api/catalog/categories/cache_stats/')
+        self.assertEqual(response.data['tree'], {'hits': 1, 'misses': 1})
+        self.assertEqual(response.data['popular'], {'hits': 0, 'misses': 0})
+
+
+class ProductSearchTests(TestCase):
+    """Full-text product search through the index backend"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.boots = Product.objects.create(
+            sku='BT-1', name='Leather boots', description='Waterproof', price='80.00', stock=2
+        )
+        self.socks = Product.objects.create(
+            sku='SK-1', name='Wool socks', description='Great with leather boots', price='8.00', stock=0
+        )
+
+    def search(self, params):
+        response = self.client.get('/api/catalog/products/search/', params)
+        return [p['sku'] for p in response.data['results']]
+
+    def test_prefix_match_ranked_by_relevance(self):
+        self.assertEqual(self.search({'q': 'leath boo'}), ['BT-1', 'SK-1'])
+        self.assertEqual(self.search({'q': 'bt'}), ['BT-1'])
+
+    def test_composes_with_filters(self):
+        self.assertEqual(self.search({'q': 'boots', 'max_price': '10'}), ['SK-1'])
+        self.assertEqual(self.search({'q': 'boots', 'in_stock': 'true'}), ['BT-1'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.socks.name = 'Cotton socks'
+        self.socks.description = ''
+        self.socks.save()
+        self.assertEqual(self.search({'q': 'leather'}), ['BT-1'])
+
+        self.boots.delete()
+        self.assertEqual(self.search({'q': 'leather'}), [])
+
+    def test_list_search_param(self):
+        response = self.client.get('/api/catalog/products/', {'search': 'wool'})
+        self.assertEqual([p['sku'] for p in response.data['results']], ['SK-1'])
+
+
+class SearchFacetTests(TestCase):
+    """Facet counts returned by the search endpoint"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shoes = Category.objects.create(name='Shoes')
+        self.hats = Category.objects.create(name='Hats')
+        for sku, price, stock, categories in [
+            ('S-1', '20.00', 1, [self.shoes]),
+            ('S-2', '60.00', 0, [self.shoes, self.hats]),
+            ('H-1', '300.00', 4, [self.hats]),
+        ]:
+            product = Product.objects.create(sku=sku, name=f'Item {sku}', price=price, stock=stock)
+            product.categories.set(categories)
+
+    def test_facet_counts(self):
+        response = self.client.get('/api/catalog/products/search/', {'facets': 'true'})
+        facets = response.data['facets']
+
+        self.assertEqual(
+            [(c['slug'], c['count']) for c in facets['categories']], [('hats', 2), ('shoes', 2)]
+        )
+        self.assertEqual([band['count'] for band in facets['price']], [1, 0, 1, 0, 1])
+        self.assertEqual(facets['availability'], {'in_stock': 2, 'out_of_stock': 1})
+
+    def test_facets_follow_filters(self):
+        response = self.client.get(
+            '/api/catalog/products/search/', {'facets': 'true', 'category': 'shoes', 'in_stock': 'true'}
+        )
+        facets = response.data['facets']
+        self.assertEqual(facets['availability'], {'in_stock': 1, 'out_of_stock': 0})
+        self.assertEqual(
+            [(c['slug'], c['count']) for c in facets['categories']], [('shoes', 1)]
+        )
+
+    def test_identical_requests_reuse_cached_facets(self):
+        self.client.get('/api/catalog/products/search/', {'facets': 'true', 'q': 'Item'})
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get('/api/catalog/products/search/', {'facets': 'true', 'q': ' item ', 'page': 1})
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get('/api/catalog/products/search/', {'q': 'item'})
+        self.assertEqual(len(cached.captured_queries), len(plain.captured_queries))
+
+    def test_facet_key_ignores_term_order(self):
+        self.assertEqual(facet_key({'q': 'red shoe'}), facet_key({'q': 'Shoe  red red'}))
+        self.assertNotEqual(facet_key({'q': 'red shoe'}), facet_key({'q': 'red'}))
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor mode of the default pagination class on product listings"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(45):
+            Product.objects.create(
+                sku=f'K-{i:02}', slug=f'k-{i}', name=f'Item {i % 7}', price=f'{i % 5}.00', stock=1
+            )
+
+    def walk(self, url):
+        skus, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            queries.append(len(ctx.captured_queries))
+            skus.extend(p['sku'] for p in response.data['results'])
+            url = response.data['next']
+        return skus, queries
+
+    def test_walks_every_row_in_order(self):
+        expected = list(Product.objects.order_by('name', 'pk').values_list('sku', flat=True))
+        skus, queries = self.walk('/api/catalog/products/?cursor=')
+        self.assertEqual(skus, expected)
+        self.assertEqual(len(set(queries)), 1)
+
+    def test_honours_ordering_param(self):
+        expected = list(Product.objects.order_by('-price', '-pk').values_list('sku', flat=True))
+        skus, _ = self.walk('/api/catalog/products/?cursor=&ordering=-price')
+        self.assertEqual(skus, expected)
+
+    def test_previous_link(self):
+        first = self.client.get('/api/catalog/products/?cursor=')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_count_opt_out(self):
+        response = self.client.get('/api/catalog/products/?cursor=&count=false')
+        self.assertNotIn('count', response.data)
+        self.assertEqual(self.client.get('/api/catalog/products/?cursor=').data['count'], 45)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/catalog/products/?cursor=bogus').status_code, 404)
+
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position, 'r': False}).encode()).decode()
 
+        # Well-formed cursors whose values do not fit the ordering fields
+        for query in [f'cursor={cursor(["x", "y"])}', f'cursor={cursor(["x", ["y"]])}',
+                      f'cursor={cursor(["not a date", 1])}&ordering=-created_at']:
+            self.assertEqual(self.client.get(f'/api/catalog/products/?{query}').status_code, 404, query)
@@ -3,7 +3,10 @@ from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from . import cache as catalog_cache
+from .facets import get_facets
 from .models import Category, Product, ProductImage
+from .search import ProductSearchFilter, get_backend as get_search_backend
 from .serializers import (
     CategorySerializer,
     CategoryTreeSerializer,
@@ -43,25 +46,26 @@ class CategoryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['GET'])
     def tree(self, request):
         """Get hierarchical category tree"""
-        root_categories = Category.objects.filter(
-            parent=None, 
-            is_active=True
-        ).order_by('name')
-        serializer = CategoryTreeSerializer(root_categories, many=True)
-        return Response(serializer.data)
+        def compute():
+            categories = Category.objects.filter(is_active=True).order_by('depth', 'name')
+            root_categories = Category.build_tree(categories)
+            return CategoryTreeSerializer(root_categories, many=True).data
+
+        return Response(catalog_cache.get_or_compute('tree', compute))
 
     @action(detail=True, methods=['GET'])
     def products(self, request, slug=None):
-        """Get products in this category"""
+        """Get products in this category and its active subcategories"""
         category = self.get_object()
-        products = category.products.filter(is_active=True)
+        products = Product.objects.filter(
+            is_active=True,
+            categories__in=category.get_active_descendants()
+        ).distinct().with_listing_data()
         
         # Apply filters
         search = request.query_params.get('search')
         if search:
-            products = products.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+            products = get_search_backend().search(products, search).order_by('search_rank', 'name')
         
         # Pagination
         page = self.paginate_queryset(products)
@@ -75,19 +79,26 @@ class CategoryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['GET'])
     def popular(self, request):
         """Get categories with most products"""
-        categories = Category.objects.filter(is_active=True).annotate(
-            product_count=Count('products', filter=Q(products__is_active=True))
-        ).filter(product_count__gt=0).order_by('-product_count')[:10]
-        
-        serializer = CategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        def compute():
+            categories = Category.objects.filter(is_active=True).annotate(
+                product_count=Count('products', filter=Q(products__is_active=True))
+            ).filter(product_count__gt=0).order_by('-product_count')[:10]
+            return CategorySerializer(categories, many=True).data
+
+        return Response(catalog_cache.get_or_compute('popular', compute))
+
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Get hit/miss counters of the category cache (Admin only)"""
+        return Response(catalog_cache.get_stats(['tree', 'popular', 'facets']))
 
 
 class ProductViewSet(viewsets.ModelViewSet):
     """ViewSet for managing products"""
     queryset = Product.objects.filter(is_active=True)
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # The search filter runs last so it can rank results when no ordering is requested
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
     filterset_fields = ['categories', 'is_active']
     search_fields = ['name', 'description', 'sku']
     ordering_fields = ['price', 'name', 'created_at', 'stock']
@@ -95,7 +106,10 @@ class ProductViewSet(viewsets.ModelViewSet):
     lookup_field = 'slug'
 
     def get_queryset(self):
-        queryset = Product.objects.prefetch_related('categories', 'images')
+        if self.action == 'list':
+            queryset = Product.objects.with_listing_data()
+        else:
+            queryset = Product.objects.prefetch_related('categories', 'images')
         if not self.request.user.is_staff:
             queryset = queryset.filter(is_active=True)
         return queryset
@@ -115,7 +129,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         products = Product.objects.filter(
             is_active=True,
             images__is_featured=True
-        ).distinct()[:10]
+        ).distinct().with_listing_data()[:10]
         
         serializer = ProductListSerializer(products, many=True)
         return Response(serializer.data)
@@ -133,7 +147,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         products = Product.objects.filter(
             is_active=True, 
             stock__lte=threshold
-        ).order_by('stock')
+        ).order_by('stock').with_listing_data()
         
         serializer = ProductListSerializer(products, many=True)
         return Response(serializer.data)
@@ -150,11 +164,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         products = Product.objects.filter(is_active=True)
 
         if query:
-            products = products.filter(
-                Q(name__icontains=query) | 
-                Q(description__icontains=query) |
-                Q(sku__icontains=query)
-            )
+            products = get_search_backend().search(products, query).order_by('search_rank', 'name')
 
         if category:
             products = products.filter(categories__slug=category)
@@ -168,15 +178,23 @@ class ProductViewSet(viewsets.ModelViewSet):
         if in_stock == 'true':
             products = products.filter(stock__gt=0)
 
-        products = products.distinct()
+        products = products.distinct().with_listing_data()
+        facets = None
+        if request.query_params.get('facets') == 'true':
+            facets = get_facets(products, request.query_params)
         
         # Pagination
         page = self.paginate_queryset(products)
         if page is not None:
             serializer = ProductListSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(serializer.data)
+            if facets is not None:
+                response.data['facets'] = facets
+            return response
 
         serializer = ProductListSerializer(products, many=True)
+        if facets is not None:
+            return Response({'results': serializer.data, 'facets': facets})
         return Response(serializer.data)
 
     @action(detail=True, methods=['POST'], permission_classes=[permissions.IsAdminUser])
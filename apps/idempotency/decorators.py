@@ -0,0 +1,126 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    raw = f'{request.method} {request.path}\n{body}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.status == IdempotencyKey.STATUS_IN_PROGRESS:
+        return Response(
+            {'error': f'A request with this {HEADER} is still in progress'},
+            status=status.HTTP_409_CONFLICT,
+            headers={'Retry-After': '1'}
+        )
+    return Response(
+        record.response_body,
+        status=record.response_status,
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+
+def _take_over(record, fingerprint, now, lease):
+    """
+    Claim a key whose request is still marked in progress but let its lock
+    lapse (e.g. the worker was killed). Returns whether the claim succeeded.
+    """
+    if (
+        record.fingerprint != fingerprint or
+        record.status != IdempotencyKey.STATUS_IN_PROGRESS or
+        (record.locked_until is not None and record.locked_until > now)
+    ):
+        return False
+    # Conditional on the lock we read, so only one retry wins
+    claimed = IdempotencyKey.objects.filter(
+        pk=record.pk, status=IdempotencyKey.STATUS_IN_PROGRESS, locked_until=record.locked_until
+    ).update(locked_until=now + lease)
+    record.locked_until = now + lease
+    return bool(claimed)
+
+
+def idempotent(view_method):
+    """
+    Honour the Idempotency-Key header on a viewset action.
+
+    The first request with a key claims it before running the action and
+    stores the response afterwards; replays with the same key and payload get
+    the stored response back from one indexed lookup. A duplicate that
+    arrives while the first is still running is rejected with 409, unless
+    the first let its lock lapse (IDEMPOTENCY_LOCK_TIMEOUT), in which case
+    the duplicate takes the key over. Only successful (2xx) responses are
+    stored: any error releases the key, so the client can fix the request
+    or wait and retry with the same key.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        lease = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is not None and record.expires_at <= now:
+            record.delete()
+            record = None
+        if record is not None and not _take_over(record, fingerprint, now, lease):
+            return _replay(record, fingerprint)
+
+        if record is None:
+            ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user,
+                        key=key,
+                        fingerprint=fingerprint,
+                        locked_until=now + lease,
+                        expires_at=now + timedelta(seconds=ttl)
+                    )
+            except IntegrityError:
+                # A concurrent duplicate claimed the key first
+                return _replay(IdempotencyKey.objects.get(user=request.user, key=key), fingerprint)
+
+        # Only while we hold the lock: a retry that took the key over owns it now
+        owned = IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            owned.delete()
+            raise
+
+        if not status.is_success(response.status_code):
+            owned.delete()
+            return response
+
+        owned.update(
+            status=IdempotencyKey.STATUS_COMPLETED,
+            response_status=response.status_code,
+            response_body=response.data,
+            locked_until=None
+        )
+        return response
+
+    return wrapper
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idempotency', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Locked until'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a request sent with an Idempotency-Key header
+    """
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_COMPLETED = 'completed'
+
+    STATUS_CHOICES = [
+        (STATUS_IN_PROGRESS, 'In progress'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    key = models.CharField('Key', max_length=255)
+    fingerprint = models.CharField('Request fingerprint', max_length=64)
+    status = models.CharField(
+        'Status',
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_IN_PROGRESS
+    )
+    response_status = models.PositiveSmallIntegerField('Response status', null=True, blank=True)
+    response_body = models.JSONField('Response body', null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_until = models.DateTimeField('Locked until', null=True, blank=True)
+    created_at = models.DateTimeField('Created at', auto_now_add=True)
+    expires_at = models.DateTimeField('Expires at', db_index=True)
+
+    class Meta:
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.get_status_display()})"
@@ -0,0 +1,123 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.carts.models import Cart, CartItem
+from apps.catalog.models import Product
+from apps.orders.models import Order
+from apps.payments.models import Payment
+from .decorators import request_fingerprint
+from .models import IdempotencyKey
+
+
+class IdempotencyKeyTests(TestCase):
+    """Idempotency-Key handling on checkout and payment actions"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(
+            sku='MUG', slug='mug', name='Mug', price=Decimal('12.50'), stock=10
+        )
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2, unit_price=self.product.price)
+
+    def checkout(self, key, address='1 Main St'):
+        return self.client.post(
+            '/api/orders/orders/create_from_cart/',
+            {'shipping_address': address},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def fingerprint(self, address):
+        request = SimpleNamespace(
+            method='POST', path='/api/orders/orders/create_from_cart/', data={'shipping_address': address}
+        )
+        return request_fingerprint(request)
+
+    def test_replay_returns_stored_response(self):
+        first = self.checkout('abc')
+        with self.assertNumQueries(1):
+            second = self.checkout('abc')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data['order_number'], first.data['order_number'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_other_payload(self):
+        self.checkout('abc')
+        self.assertEqual(self.checkout('abc', address='2 Side St').status_code, 422)
+
+    def test_in_flight_duplicate_is_rejected(self):
+        self.checkout('busy')
+        IdempotencyKey.objects.update(
+            status=IdempotencyKey.STATUS_IN_PROGRESS, locked_until=timezone.now() + timedelta(seconds=30)
+        )
+
+        response = self.checkout('busy')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_lapsed_lock_is_taken_over(self):
+        # The worker running the first request died before storing a response
+        IdempotencyKey.objects.create(
+            user=self.user, key='lost', fingerprint=self.fingerprint('1 Main St'),
+            locked_until=timezone.now() - timedelta(seconds=1), expires_at=timezone.now() + timedelta(hours=1)
+        )
+
+        response = self.checkout('lost')
+        self.assertEqual(response.status_code, 201)
+        record = IdempotencyKey.objects.get()
+        self.assertEqual((record.status, record.locked_until), (IdempotencyKey.STATUS_COMPLETED, None))
+        self.assertEqual(self.checkout('lost')['Idempotent-Replayed'], 'true')
+
+    def test_expired_key_runs_again(self):
+        self.checkout('abc')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.checkout('abc')
+        self.assertEqual(response.status_code, 400)  # the cart is empty by now
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_client_error_is_not_stored(self):
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('15.00'))
+
+        self.assertEqual(self.checkout('abc').status_code, 409)  # the price moved
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.checkout('abc')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(response.data['total_amount'], '30.00')
+
+    def test_payment_process_replay(self):
+        order = Order.objects.create(
+            order_number='ORD-1', user=self.user, total_amount=Decimal('25.00'), shipping_address='x'
+        )
+        payment = Payment.objects.create(order=order, amount=Decimal('25.00'))
+        url = f'/api/payments/payments/{payment.pk}/process/'
+
+        first = self.client.post(url, {}, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+        second = self.client.post(url, {}, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+
+        self.assertEqual(first.status_code, 200, first.data)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(payment.transactions.filter(success=True).count(), 1)
+
+    def test_purge_expired_keys(self):
+        self.checkout('old')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
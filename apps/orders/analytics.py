@@ -0,0 +1,133 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import Order, OrderStats, ProductSales
+from .rollups import bucket_start
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _stats_rows(start=None, end=None, granularity='day'):
+    rows = OrderStats.objects.filter(granularity=granularity)
+    if start is not None:
+        rows = rows.filter(bucket__gte=start)
+    if end is not None:
+        rows = rows.filter(bucket__lt=end)
+    return rows
+
+
+def _day_from(moment):
+    """First day whose (local) start is at or after `moment`"""
+    midnight = bucket_start(moment, 'day')
+    return midnight.date() + timedelta(days=1 if midnight < moment else 0)
+
+
+def _sales_rows(model, start=None, end=None):
+    """
+    Daily sales facts in [start, end), with the same bounds as the day
+    stats buckets: a day counts when its start is in the range, so a
+    partial final day is included and a partial first day is not.
+    """
+    rows = model.objects.all()
+    if start is not None:
+        rows = rows.filter(day__gte=_day_from(start))
+    if end is not None:
+        rows = rows.filter(day__lt=_day_from(end))
+    return rows
+
+
+def _status_totals(rows):
+    """Fold (status, count, amount) rows into the stats payload"""
+    stats = {'total_orders': 0, 'total_sales': Decimal('0.00')}
+    stats.update({f'{status}_orders': 0 for status, _ in Order.STATUS_CHOICES})
+    for row in rows:
+        stats['total_orders'] += row['order_count']
+        stats['total_sales'] += row['total_amount'] or Decimal('0.00')
+        stats[f"{row['status']}_orders"] += row['order_count']
+    return stats
+
+
+def order_stats(start=None, end=None, granularity='day', series=False):
+    """
+    Order counts per status and total sales from the rollups, optionally
+    with one entry per hour/day bucket. The cost depends on the number of
+    buckets in the range, not on the number of orders.
+    """
+    rows = _stats_rows(start, end, granularity)
+    stats = _status_totals(
+        rows.values('status').annotate(order_count=Sum('order_count'), total_amount=Sum('total_amount'))
+    )
+    if series:
+        buckets = {}
+        for row in rows.order_by('bucket').values('bucket', 'status', 'order_count', 'total_amount'):
+            buckets.setdefault(row['bucket'], []).append(row)
+        stats['series'] = [
+            dict(bucket=bucket, **_status_totals(bucket_rows)) for bucket, bucket_rows in buckets.items()
+        ]
+    return stats
+
+
+def revenue_series(start=None, end=None, period='day'):
+    """Revenue and order count per day/week/month, excluding cancelled orders"""
+    return list(
+        _stats_rows(start, end).exclude(status='cancelled')
+        .annotate(period=PERIODS[period]('bucket'))
+        .values('period')
+        .annotate(revenue=Sum('total_amount'), orders=Sum('order_count'))
+        .order_by('period')
+    )
+
+
+def average_order_value(start=None, end=None):
+    totals = _stats_rows(start, end).exclude(status='cancelled').aggregate(
+        revenue=Sum('total_amount'), orders=Sum('order_count')
+    )
+    revenue = totals['revenue'] or Decimal('0.00')
+    orders = totals['orders'] or 0
+    return {
+        'orders': orders,
+        'revenue': revenue,
+        'average_order_value': (revenue / orders).quantize(Decimal('0.01')) if orders else Decimal('0.00'),
+    }
+
+
+def top_products(start=None, end=None, limit=10, by='revenue'):
+    """Best selling products by revenue or units"""
+    return list(
+        _sales_rows(ProductSales, start, end)
+        .values('product', 'product__name', 'product__sku')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .filter(units__gt=0)
+        .order_by(f'-{by}', 'product')[:limit]
+    )
+
+
+def top_categories(start=None, end=None, limit=10, by='revenue'):
+    """
+    Best selling categories by revenue or units, from the product sales
+    facts and the categories the products have now: a recategorised
+    product takes its past sales along, as a rebuild of the facts would.
+    """
+    rows = (
+        _sales_rows(ProductSales, start, end).filter(product__categories__isnull=False)
+        .values('product__categories', 'product__categories__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .filter(units__gt=0)
+        .order_by(f'-{by}', 'product__categories')[:limit]
+    )
+    return [
+        {
+            'category': row['product__categories'],
+            'category__name': row['product__categories__name'],
+            'units': row['units'],
+            'revenue': row['revenue'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,58 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Buffer:
+    """File-like object that hands back what csv.writer writes instead of keeping it"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, fields, output='csv', chunk_size=2000):
+    """
+    Yield `queryset` as CSV or NDJSON text, `chunk_size` rows per piece.
+
+    Rows are read as values() tuples through iterator(), so no model
+    instances are built and the database driver streams them in chunks
+    (a server-side cursor on PostgreSQL): memory stays flat however many
+    rows are exported.
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    writer = csv.writer(_Buffer())
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    if output == 'csv':
+        encode = writer.writerow
+        yield writer.writerow(fields)
+    else:
+        def encode(row):
+            return encoder.encode(dict(zip(fields, row))) + '\n'
+
+    lines = []
+    for row in rows:
+        lines.append(encode(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export_response(queryset, fields, name, output='csv', chunk_size=2000):
+    """Stream `queryset` as a file download named `<name>-<date>.<output>`"""
+    response = StreamingHttpResponse(
+        export_rows(queryset, fields, output, chunk_size),
+        content_type=EXPORT_FORMATS[output]
+    )
+    filename = f"{name}-{timezone.localdate():%Y%m%d}.{output}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,58 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.orders.exports import export_rows
+from apps.orders.models import Order
+from apps.orders.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming an order export and check its peak memory (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Orders to export')
+        parser.add_argument('--output', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--ceiling', type=float, default=32, help='Peak memory limit in MiB')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username='bench-export', password='x')
+            for start in range(0, rows, 10_000):
+                # bulk_create skips the rollup signals, which the export does not read anyway
+                Order.objects.bulk_create([
+                    Order(
+                        order_number=f'BENCH-{i}', user=user, total_amount=Decimal('19.99'),
+                        shipping_address='1 Benchmark Street, Springfield'
+                    )
+                    for i in range(start, min(start + 10_000, rows))
+                ])
+
+            queryset = Order.objects.filter(user=user).order_by('-created_at')
+            tracemalloc.start()
+            started = time.perf_counter()
+            size = exported = 0
+            for piece in export_rows(queryset, OrderViewSet.export_fields, options['output'], options['chunk_size']):
+                size += len(piece)
+                exported += piece.count('\n')
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            transaction.set_rollback(True)
+
+        peak_mib = peak / 2 ** 20
+        self.stdout.write(
+            f"{rows} orders, {exported} lines, {size / 2 ** 20:.1f} MiB of {options['output']} "
+            f"in {elapsed:.2f} s ({rows / elapsed:,.0f} rows/s), peak Python memory {peak_mib:.2f} MiB"
+        )
+        if peak_mib > options['ceiling']:
+            raise CommandError(f"Peak memory {peak_mib:.2f} MiB exceeds {options['ceiling']} MiB")
+        self.stdout.write(self.style.SUCCESS(f"Within the {options['ceiling']} MiB ceiling"))
@@ -0,0 +1,76 @@
+import multiprocessing
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from apps.orders.models import OrderNumberSequence
+from apps.orders.numbers import OrderNumberAllocator
+
+
+def _allocate(name, block_size, threads, per_thread):
+    """Allocate numbers from `threads` threads of this process; returns them all"""
+    connections.close_all()
+    allocator = OrderNumberAllocator(name=name, block_size=block_size)
+    results = [[] for _ in range(threads)]
+    errors = []
+
+    def worker(index):
+        try:
+            results[index] = [allocator.next() for _ in range(per_thread)]
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return [number for numbers in results for number in numbers]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark order number allocation across threads and processes and check for duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--numbers', type=int, default=2_000_000, help='Total numbers to allocate')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=4, help='Threads per process')
+        parser.add_argument('--block-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        workers = options['processes'] * options['threads']
+        per_thread = options['numbers'] // workers
+        if per_thread < 1:
+            raise CommandError('--numbers must be at least processes x threads')
+        # A dedicated sequence, so the benchmark never consumes real order numbers
+        name = f'benchmark-{time.time_ns()}'
+
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        start = time.perf_counter()
+        with context.Pool(options['processes']) as pool:
+            batches = pool.starmap(
+                _allocate,
+                [(name, options['block_size'], options['threads'], per_thread)] * options['processes']
+            )
+        elapsed = time.perf_counter() - start
+
+        numbers = [number for batch in batches for number in batch]
+        unique = len(set(numbers))
+        blocks = -(-len(numbers) // options['block_size'])
+        OrderNumberSequence.objects.filter(name=name).delete()
+
+        self.stdout.write(
+            f"{len(numbers)} numbers from {options['processes']} processes x {options['threads']} threads "
+            f"in {elapsed:.2f} s ({len(numbers) / elapsed:,.0f}/s), ~{blocks} block reservations, "
+            f"sample {numbers[0]}"
+        )
+        if unique != len(numbers):
+            raise CommandError(f'{len(numbers) - unique} duplicate order numbers')
+        self.stdout.write(self.style.SUCCESS('No duplicates'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+
+from apps.orders.models import Order, OrderItem, OrderStats, ProductSales
+
+
+class Command(BaseCommand):
+    help = 'Recompute the order stats rollups and daily sales facts from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        sold = OrderItem.objects.exclude(order__status='cancelled')
+
+        with transaction.atomic():
+            OrderStats.objects.all().delete()
+            ProductSales.objects.all().delete()
+
+            for granularity, trunc in [('hour', TruncHour), ('day', TruncDay)]:
+                rows = (
+                    Order.objects.annotate(bucket=trunc('created_at')).order_by()
+                    .values('bucket', 'status')
+                    .annotate(order_count=Count('id'), total_amount=Sum('total_amount'))
+                )
+                OrderStats.objects.bulk_create(
+                    (OrderStats(granularity=granularity, **row) for row in rows.iterator()),
+                    batch_size=batch_size
+                )
+
+            rows = (
+                sold.annotate(day=TruncDay('order__created_at')).order_by()
+                .values('day', 'product_id')
+                .annotate(units=Sum('quantity'), revenue=Sum('subtotal'))
+            )
+            ProductSales.objects.bulk_create(
+                (ProductSales(**dict(row, day=row['day'].date())) for row in rows.iterator()),
+                batch_size=batch_size
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {OrderStats.objects.count()} stats rows and {ProductSales.objects.count()} product sales rows'
+        ))
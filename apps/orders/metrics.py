@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Upper bounds of the histogram buckets; the last bucket is open-ended
+LINE_BUCKETS = [1, 5, 10, 25, 50, 100]
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000]
+
+KEY = 'orders:checkout:{lines}:{latency}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'ORDERS_METRICS_CACHE_ALIAS', 'default')]
+
+
+def _bucket(value, bounds):
+    for bound in bounds:
+        if value <= bound:
+            return str(bound)
+    return 'inf'
+
+
+def record_checkout(lines, seconds):
+    """Count one checkout transaction in the (lines, latency) histogram"""
+    key = KEY.format(
+        lines=_bucket(lines, LINE_BUCKETS),
+        latency=_bucket(seconds * 1000, LATENCY_BUCKETS_MS),
+    )
+    cache = get_cache()
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def _line_ranges():
+    """Labels of the line-count groups, e.g. '1', '2-5', ..., '101+'"""
+    labels, low = [], 1
+    for bound in LINE_BUCKETS:
+        labels.append(str(bound) if bound == low else f'{low}-{bound}')
+        low = bound + 1
+    return labels + [f'{low}+']
+
+
+def checkout_histogram():
+    """
+    Checkout transaction latency histogram (milliseconds) per group of
+    line counts. Latency buckets are cumulative: `le_50_ms` counts every
+    checkout that took 50 ms or less, and `le_inf_ms` is the group total.
+    """
+    line_labels = [str(bound) for bound in LINE_BUCKETS] + ['inf']
+    latency_labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ['inf']
+    counts = get_cache().get_many([
+        KEY.format(lines=lines, latency=latency) for lines in line_labels for latency in latency_labels
+    ])
+
+    histogram = {}
+    for lines, group in zip(line_labels, _line_ranges()):
+        buckets, total = {}, 0
+        for latency in latency_labels:
+            total += counts.get(KEY.format(lines=lines, latency=latency), 0)
+            buckets[f'le_{latency}_ms'] = total
+        histogram[f'{group}_lines'] = buckets
+    return histogram
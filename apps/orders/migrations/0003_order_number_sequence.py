@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_orders_orde_created_0fb29d_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Name')),
+                ('next_value', models.PositiveBigIntegerField(default=1, verbose_name='Next value')),
+            ],
+            options={
+                'verbose_name': 'Order Number Sequence',
+                'verbose_name_plural': 'Order Number Sequences',
+            },
+        ),
+    ]
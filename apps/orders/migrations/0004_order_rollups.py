@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:53
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_product_catalog_pro_name_192a7a_idx'),
+        ('orders', '0003_order_number_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4, verbose_name='Granularity')),
+                ('bucket', models.DateTimeField(verbose_name='Bucket start')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=10, verbose_name='Status')),
+                ('order_count', models.IntegerField(default=0, verbose_name='Order count')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='Total amount')),
+            ],
+            options={
+                'verbose_name': 'Order Stats',
+                'verbose_name_plural': 'Order Stats',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'status'), name='unique_order_stats_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('units', models.IntegerField(default=0, verbose_name='Units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='Revenue')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.category')),
+            ],
+            options={
+                'verbose_name': 'Category Sales',
+                'verbose_name_plural': 'Category Sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'category'), name='unique_category_sales_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Day')),
+                ('units', models.IntegerField(default=0, verbose_name='Units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='Revenue')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product')),
+            ],
+            options={
+                'verbose_name': 'Product Sales',
+                'verbose_name_plural': 'Product Sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='unique_product_sales_day')],
+            },
+        ),
+    ]
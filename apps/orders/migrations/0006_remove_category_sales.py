@@ -0,0 +1,16 @@
+# Generated by Django 5.2.6 on 2026-10-17 08:59
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_transitions'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CategorySales',
+        ),
+    ]
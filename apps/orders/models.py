@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from decimal import Decimal
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -9,6 +10,15 @@ class Order(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled')
     ]
+    # The order state machine: statuses an order may move to from each status.
+    # Every status change goes through orders.transitions, which checks this table
+    TRANSITIONS = {
+        'pending': {'processing', 'shipped', 'cancelled'},
+        'processing': {'shipped', 'cancelled'},
+        'shipped': {'completed'},
+        'completed': set(),
+        'cancelled': set(),
+    }
     order_number = models.CharField('Order number', max_length=20, unique=True)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, 
@@ -33,10 +43,76 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the rollups last counted, so saves can move the difference
+        instance._stored = (instance.__dict__.get('status'), instance.__dict__.get('total_amount'))
+        return instance
+
+    def can_transition(self, status):
+        """Whether the state machine allows moving from the current status to `status`"""
+        return status in self.TRANSITIONS.get(self.status, ())
 
     def __str__(self):
         return f"#{self.order_number} - ({self.user})"
-    
+
+
+class OrderTransition(models.Model):
+    """Append-only log of order status changes"""
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='transitions'
+    )
+    from_status = models.CharField('From status', max_length=10, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField('To status', max_length=10, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    source = models.CharField('Source', max_length=20, blank=True)  # api, bulk, cancel, payment, refund
+    created_at = models.DateTimeField('Created at', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Order Transition'
+        verbose_name_plural = 'Order Transitions'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order transitions cannot be changed once recorded")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+class OrderNumberSequence(models.Model):
+    """Counter that order-number blocks are reserved from (see orders.numbers)"""
+    name = models.CharField('Name', max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField('Next value', default=1)
+
+    class Meta:
+        verbose_name = 'Order Number Sequence'
+        verbose_name_plural = 'Order Number Sequences'
+
+    def __str__(self):
+        return f"{self.name} (next {self.next_value})"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order,
@@ -64,4 +140,87 @@ class OrderItem(models.Model):
         verbose_name_plural = 'Order Items'
     
     def __str__(self):
-        return f"{self.quantity} x {self.product}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product}"
+
+
+class OrderStats(models.Model):
+    """Order count and sales per status and hour/day, maintained incrementally"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    granularity = models.CharField('Granularity', max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField('Bucket start')
+    status = models.CharField('Status', max_length=10, choices=Order.STATUS_CHOICES)
+    order_count = models.IntegerField('Order count', default=0)
+    total_amount = models.DecimalField(
+        'Total amount',
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+
+    class Meta:
+        verbose_name = 'Order Stats'
+        verbose_name_plural = 'Order Stats'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket', 'status'], name='unique_order_stats_bucket'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket:%Y-%m-%d %H:00} {self.status}: {self.order_count}"
+
+
+class ProductSales(models.Model):
+    """Units and revenue per product and day, excluding cancelled orders"""
+    day = models.DateField('Day')
+    product = models.ForeignKey(
+        'catalog.Product',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    units = models.IntegerField('Units', default=0)
+    revenue = models.DecimalField('Revenue', max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Product Sales'
+        verbose_name_plural = 'Product Sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_product_sales_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.units} / {self.revenue}"
+
+
+# Signals to keep the order rollups and sales facts current
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from .rollups import order_lines, record_sales, shift_order_stats
+
+@receiver(post_save, sender=Order)
+def update_order_rollups(sender, instance, created, **kwargs):
+    """Move the order between status rollups; drop or restore its sales when (un)cancelled"""
+    old_status, old_amount = (None, None) if created else getattr(instance, '_stored', (None, None))
+    new_status, new_amount = instance.status, instance.total_amount
+    instance._stored = (new_status, new_amount)
+    if (not created and old_status is None) or (old_status, old_amount) == (new_status, new_amount):
+        return
+
+    changes = [(instance.created_at, new_status, 1, new_amount)]
+    if old_status is not None:
+        changes.append((instance.created_at, old_status, -1, -old_amount))
+    shift_order_stats(changes)
+
+    # Lines of new orders are recorded by whoever creates them, once they exist
+    if old_status is not None and (old_status == 'cancelled') != (new_status == 'cancelled'):
+        record_sales(order_lines(instance), sign=-1 if new_status == 'cancelled' else 1)
+
+@receiver(pre_delete, sender=Order)
+def remove_order_rollups(sender, instance, **kwargs):
+    status, amount = getattr(instance, '_stored', (instance.status, instance.total_amount))
+    shift_order_stats([(instance.created_at, status, -1, -amount)])
+    if status != 'cancelled':
+        record_sales(order_lines(instance), sign=-1)
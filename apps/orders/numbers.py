@@ -0,0 +1,131 @@
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import OrderNumberSequence
+
+# Crockford base32: no I, L, O or U, so numbers read back unambiguously
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+BITS = 44
+HALF = BITS // 2
+# 9 characters, so no number can equal a legacy ORD-<8 hex characters> one
+WIDTH = -(-BITS // 5)
+MASK = (1 << HALF) - 1
+ROUNDS = 4
+
+
+def _round_keys():
+    secret = getattr(settings, 'ORDER_NUMBER_KEY', None) or settings.SECRET_KEY
+    return [
+        hmac.new(secret.encode(), f'order-number:{i}'.encode(), hashlib.sha256).digest()
+        for i in range(ROUNDS)
+    ]
+
+
+def scramble(value, keys=None):
+    """
+    Keyed permutation of the 44-bit space (a Feistel network), so
+    consecutive sequence values map to unrelated-looking numbers while
+    distinct inputs can never map to the same output.
+    """
+    keys = keys or _round_keys()
+    left, right = value >> HALF, value & MASK
+    for key in keys:
+        digest = hmac.new(key, right.to_bytes(3, 'big'), hashlib.sha256).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:3], 'big') & MASK)
+    return (left << HALF) | right
+
+
+def encode(value):
+    """Fixed-width base32 text of a 44-bit value (WIDTH characters)"""
+    chars = []
+    for _ in range(WIDTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def reserve_block(name, size):
+    """Reserve `size` consecutive sequence values and return the first one"""
+    while True:
+        with transaction.atomic():
+            if OrderNumberSequence.objects.filter(name=name).update(next_value=F('next_value') + size):
+                # The UPDATE holds the row until commit, so this reads our own increment
+                end = OrderNumberSequence.objects.values_list('next_value', flat=True).get(name=name)
+                return end - size
+        try:
+            with transaction.atomic():
+                OrderNumberSequence.objects.create(name=name, next_value=1 + size)
+                return 1
+        except IntegrityError:
+            # Another node created the sequence first; take a block from it
+            continue
+
+
+class OrderNumberAllocator:
+    """
+    Hands out order numbers from blocks reserved in OrderNumberSequence.
+
+    Each thread draws from its own block, so only one order in every
+    `block_size` pays a round trip and no lock is shared between threads;
+    processes and hosts never overlap because blocks come from one
+    database counter. Numbers are the keyed permutation of the sequence
+    value, base32-encoded: compact, unique and not enumerable.
+
+    Draw numbers before opening a transaction. A block reserved inside a
+    transaction is only trusted while that transaction can still commit: a
+    rollback (of it or of a savepoint around the reservation) discards the
+    block's commit callback, and the next draw then reserves a new block.
+    """
+
+    def __init__(self, name='orders', block_size=None):
+        self.name = name
+        self.block_size = block_size or settings.ORDER_NUMBER_BLOCK_SIZE
+        self.local = threading.local()
+        self.keys = _round_keys()
+
+    def _reserve(self):
+        state = self.local
+        state.next = reserve_block(self.name, self.block_size)
+        state.end = state.next + self.block_size
+        state.pending = None
+        if connection.in_atomic_block:
+            def confirm():
+                if state.pending is confirm:
+                    state.pending = None
+            state.pending = confirm
+            transaction.on_commit(confirm)
+
+    def _usable(self):
+        """Whether the current block is reserved and not rolled back"""
+        state = self.local
+        if getattr(state, 'next', None) is None or state.next >= state.end:
+            return False
+        # Rollbacks drop the callbacks registered under them, so a pending callback
+        # still in the queue means the reservation can still commit
+        return state.pending is None or any(func is state.pending for _, func, _ in connection.run_on_commit)
+
+    def next_value(self):
+        state = self.local
+        if not self._usable():
+            self._reserve()
+        value = state.next
+        state.next += 1
+        if value >= 1 << BITS:
+            raise OverflowError('Order number space exhausted')
+        return value
+
+    def next(self):
+        return f'{settings.ORDER_NUMBER_PREFIX}{encode(scramble(self.next_value(), self.keys))}'
+
+
+allocator = OrderNumberAllocator()
+
+
+def next_order_number():
+    """A new unique order number, e.g. ORD-B7K2M9QXD"""
+    return allocator.next()
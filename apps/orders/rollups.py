@@ -0,0 +1,136 @@
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import OrderStats, ProductSales
+
+GRANULARITIES = ['hour', 'day']
+UPSERT_BATCH_SIZE = 500
+CASE_BATCH_SIZE = 200
+
+
+def bucket_start(moment, granularity, tz=None):
+    """Start of the hour/day containing `moment`, in `tz` or the current time zone"""
+    moment = timezone.localtime(moment, tz).replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def increment(model, deltas):
+    """
+    Add {lookup_tuple: {field: delta}} to counter rows of `model`.
+
+    `lookup_tuple` is a tuple of (field, value) pairs naming a unique row.
+    Each chunk of rows is applied with one INSERT ... ON CONFLICT DO UPDATE
+    SET field = field + excluded.field, so missing rows are created,
+    concurrent writers never lose each other's deltas and the statement
+    does not grow deeper with the number of distinct rows.
+    """
+    deltas = {lookup: fields for lookup, fields in deltas.items() if any(fields.values())}
+    if not deltas:
+        return
+
+    keys = [name for name, _ in next(iter(deltas))]
+    fields = sorted({field for changes in deltas.values() for field in changes})
+    if not connection.features.supports_update_conflicts_with_target:
+        return _increment_with_case(model, deltas, fields)
+
+    meta, quote = model._meta, connection.ops.quote_name
+    columns = [meta.get_field(name) for name in keys + fields]
+    table = quote(meta.db_table)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(quote(f.column) for f in columns)}) VALUES {{values}} "
+        f"ON CONFLICT ({', '.join(quote(meta.get_field(name).column) for name in keys)}) DO UPDATE SET "
+        + ', '.join(
+            f"{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}"
+            for column in (meta.get_field(field).column for field in fields)
+        )
+    )
+    rows = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(
+            columns, [value for _, value in lookup] + [changes.get(field, 0) for field in fields]
+        )]
+        for lookup, changes in deltas.items()
+    ]
+    placeholder = f"({', '.join(['%s'] * len(columns))})"
+    chunk = max(1, min(UPSERT_BATCH_SIZE, (connection.features.max_query_params or 2 ** 15) // len(columns)))
+
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        for start in range(0, len(rows), chunk):
+            batch = rows[start:start + chunk]
+            cursor.execute(
+                sql.format(values=', '.join([placeholder] * len(batch))),
+                [value for row in batch for value in row]
+            )
+
+
+def _increment_with_case(model, deltas, fields):
+    """increment() for backends without ON CONFLICT (target): zero rows, then CASE-based UPDATEs"""
+    lookups = list(deltas)
+    with transaction.atomic(savepoint=False):
+        model.objects.bulk_create([model(**dict(lookup)) for lookup in lookups], ignore_conflicts=True)
+        # Bounded chunks keep the OR/CASE expression well under backend depth limits
+        for start in range(0, len(lookups), CASE_BATCH_SIZE):
+            batch = lookups[start:start + CASE_BATCH_SIZE]
+            model.objects.filter(reduce(or_, (Q(**dict(lookup)) for lookup in batch))).update(**{
+                field: F(field) + Case(
+                    *[When(Q(**dict(lookup)), then=Value(deltas[lookup].get(field, 0))) for lookup in batch],
+                    default=Value(0),
+                    output_field=model._meta.get_field(field),
+                )
+                for field in fields
+            })
+
+
+def shift_order_stats(changes):
+    """
+    Apply [(created_at, status, count_delta, amount_delta), ...] to the
+    hourly and daily rollups. Set-based status updates call this with every
+    order they moved; it still issues a fixed number of queries.
+    """
+    tz = timezone.get_current_timezone()
+    deltas = defaultdict(lambda: {'order_count': 0, 'total_amount': Decimal('0.00')})
+    for created_at, status, count, amount in changes:
+        hour = bucket_start(created_at, 'hour', tz)
+        for granularity, bucket in zip(GRANULARITIES, (hour, hour.replace(hour=0))):
+            key = (('granularity', granularity), ('bucket', bucket), ('status', status))
+            deltas[key]['order_count'] += count
+            deltas[key]['total_amount'] += amount
+    increment(OrderStats, deltas)
+
+
+def record_sales(lines, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) order lines in the daily product sales
+    facts. `lines` are dicts with created_at, product_id, quantity and
+    subtotal.
+    """
+    lines = list(lines)
+    if not lines:
+        return
+
+    tz = timezone.get_current_timezone()
+    deltas = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0.00')})
+    for line in lines:
+        key = (('day', bucket_start(line['created_at'], 'day', tz).date()), ('product_id', line['product_id']))
+        deltas[key]['units'] += sign * line['quantity']
+        deltas[key]['revenue'] += sign * line['subtotal']
+    increment(ProductSales, deltas)
+
+
+def order_lines(order, items=None):
+    """Sales lines of an order from loaded items, or one query when not given"""
+    if items is None:
+        items = order.items.values('product_id', 'quantity', 'subtotal')
+    else:
+        items = [
+            {'product_id': item.product_id, 'quantity': item.quantity, 'subtotal': item.subtotal}
+            for item in items
+        ]
+    return [dict(item, created_at=order.created_at) for item in items]
@@ -1,10 +1,23 @@
 from rest_framework import serializers
 from decimal import Decimal
-import uuid
-from .models import Order, OrderItem
+from .analytics import PERIODS
+from .exports import EXPORT_FORMATS
+from .models import Order, OrderItem, OrderStats
+from .numbers import next_order_number
+from .rollups import order_lines, record_sales
+from .transitions import InvalidTransition, transition
 from apps.catalog.serializers import ProductListSerializer
 
 
+def items_count(order):
+    """Lines of an order from its items_count annotation or prefetched items, else one query"""
+    if hasattr(order, 'items_count'):
+        return order.items_count
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        return len(order.items.all())
+    return order.items.count()
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     """Order item serializer with product details"""
     
@@ -71,7 +84,7 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return items_count(obj)
 
     def get_user_details(self, obj):
         return {
@@ -85,31 +98,40 @@ class OrderSerializer(serializers.ModelSerializer):
         items_data = validated_data.pop('items', [])
         
         # Generate order number
-        validated_data['order_number'] = f"ORD-{uuid.uuid4().hex[:8].upper()}"
-        
-        order = Order.objects.create(**validated_data)
-        
+        validated_data['order_number'] = next_order_number()
+
         total_amount = Decimal('0.00')
         for item_data in items_data:
             item_data['subtotal'] = item_data['quantity'] * item_data['unit_price']
-            OrderItem.objects.create(order=order, **item_data)
             total_amount += item_data['subtotal']
-        
-        order.total_amount = total_amount
-        order.save()
-        
+        validated_data['total_amount'] = total_amount
+
+        order = Order.objects.create(**validated_data)
+        items = [OrderItem.objects.create(order=order, **item_data) for item_data in items_data]
+        if order.status != 'cancelled':
+            record_sales(order_lines(order, items))
+
         return order
 
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
+        new_status = validated_data.pop('status', instance.status)
+        if new_status != instance.status and not instance.can_transition(new_status):
+            raise serializers.ValidationError({'status': str(InvalidTransition(instance, new_status))})
         
         # Update order fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
 
+        # Status changes go through the state machine
+        request = self.context.get('request')
+        transition(instance, new_status, user=getattr(request, 'user', None))
+
         # Update items if provided
         if items_data is not None:
+            if instance.status != 'cancelled':
+                record_sales(order_lines(instance), sign=-1)
             instance.items.all().delete()
             total_amount = Decimal('0.00')
             
@@ -120,6 +142,8 @@ class OrderSerializer(serializers.ModelSerializer):
             
             instance.total_amount = total_amount
             instance.save()
+            if instance.status != 'cancelled':
+                record_sales(order_lines(instance))
 
         return instance
 
@@ -143,7 +167,7 @@ class OrderListSerializer(serializers.ModelSerializer):
         ]
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return items_count(obj)
 
 
 class CreateOrderFromCartSerializer(serializers.Serializer):
@@ -162,4 +186,43 @@ class OrderStatusUpdateSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Order
-        fields = ['status']
\ No newline at end of file
+        fields = ['status']
+
+
+class BulkOrderStatusSerializer(serializers.Serializer):
+    """Orders (by id and/or order number) to move to one status"""
+
+    ids = serializers.ListField(child=serializers.IntegerField(), max_length=10000, required=False, default=list)
+    order_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=20), max_length=10000, required=False, default=list
+    )
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+    def validate(self, attrs):
+        if not attrs['ids'] and not attrs['order_numbers']:
+            raise serializers.ValidationError("Provide ids or order_numbers.")
+        return attrs
+
+
+class OrderStatsQuerySerializer(serializers.Serializer):
+    """Query parameters of the order stats endpoint"""
+
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    granularity = serializers.ChoiceField(choices=OrderStats.GRANULARITY_CHOICES, required=False)
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    """Query parameters of the sales analytics endpoints"""
+
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    by = serializers.ChoiceField(choices=['revenue', 'units'], default='revenue')
+    period = serializers.ChoiceField(choices=list(PERIODS), default='day')
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    """Query parameters of the export endpoints"""
+
+    output = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default='csv')
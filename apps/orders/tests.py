@@ -1,2 +1,737 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
 
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.carts.models import Cart, CartItem
+from apps.catalog.models import Category, Product
+from apps.catalog.stock import InsufficientStock, reserve_stock
+from .exports import export_rows
+from .metrics import KEY, checkout_histogram, record_checkout
+from .models import (
+    Order, OrderItem, OrderNumberSequence, OrderStats, OrderTransition, ProductSales,
+)
+from .numbers import OrderNumberAllocator, scramble
+from .rollups import order_lines, record_sales, shift_order_stats
+from .transitions import InvalidTransition, transition
+
+
+class CheckoutTestMixin:
+    def create_user(self, username='buyer', **extra):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password='pass', **extra
+        )
+
+    def create_product(self, sku, stock, price=Decimal('10.00')):
+        return Product.objects.create(sku=sku, slug=sku.lower(), name=sku, price=price, stock=stock)
+
+    def fill_cart(self, user, lines):
+        cart = Cart.objects.create(user=user)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity, unit_price=product.price)
+        return cart
+
+
+class CreateFromCartStockTests(CheckoutTestMixin, TestCase):
+    """Stock reservation during checkout and its release on cancel"""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.shirt = self.create_product('SHIRT', stock=5)
+        self.hat = self.create_product('HAT', stock=2)
+
+    def checkout(self):
+        return self.client.post(
+            '/api/orders/orders/create_from_cart/', {'shipping_address': '1 Main St'}, format='json'
+        )
+
+    def test_checkout_decrements_stock(self):
+        self.fill_cart(self.user, [(self.shirt, 3), (self.hat, 2)])
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201)
+        self.shirt.refresh_from_db()
+        self.hat.refresh_from_db()
+        self.assertEqual((self.shirt.stock, self.hat.stock), (2, 0))
+
+    def test_shortfall_reserves_nothing(self):
+        self.fill_cart(self.user, [(self.shirt, 3), (self.hat, 2)])
+        Product.objects.filter(pk=self.hat.pk).update(stock=1)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['shortfalls'],
+            [{'product': self.hat.pk, 'sku': 'HAT', 'requested': 2, 'available': 1}]
+        )
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_restocks(self):
+        self.fill_cart(self.user, [(self.shirt, 3)])
+        order_id = self.checkout().data['id']
+
+        response = self.client.post(f'/api/orders/orders/{order_id}/cancel/')
+
+        self.assertEqual(response.status_code, 200)
+        self.shirt.refresh_from_db()
+        self.assertEqual(self.shirt.stock, 5)
+
+
+class BulkCheckoutTests(CheckoutTestMixin, TestCase):
+    """Checkout writes are set-based regardless of the number of cart lines"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def checkout_writes(self, username, lines):
+        user = self.create_user(username)
+        products = [self.create_product(f'{username}-{i}', stock=10) for i in range(lines)]
+        self.fill_cart(user, [(product, 2) for product in products])
+        self.client.force_authenticate(user)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/orders/orders/create_from_cart/', {'shipping_address': 'Dock 4'}, format='json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_amount']), Decimal('20.00') * lines)
+        # Order-number block reservations happen once per block, not per checkout
+        return [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE')) and 'orders_ordernumbersequence' not in q['sql']
+        ]
+
+    def test_writes_do_not_grow_with_lines(self):
+        small = self.checkout_writes('small', 2)
+        large = self.checkout_writes('large', 30)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Product.objects.filter(stock=8).count(), 32)
+
+    def test_checkout_histogram(self):
+        self.checkout_writes('buyer', 3)
+        staff = self.create_user('staff', is_staff=True)
+        self.client.force_authenticate(staff)
+
+        histogram = self.client.get('/api/orders/orders/checkout_metrics/').data
+        self.assertEqual(histogram['2-5_lines']['le_inf_ms'], 1)
+        self.assertEqual(histogram['1_lines']['le_inf_ms'], 0)
+        self.assertEqual(list(histogram), ['1_lines', '2-5_lines', '6-10_lines', '11-25_lines',
+                                           '26-50_lines', '51-100_lines', '101+_lines'])
+        # Cumulative: each latency bucket includes the faster ones
+        counts = list(histogram['2-5_lines'].values())
+        self.assertEqual(counts, sorted(counts))
+
+    @override_settings(ORDERS_METRICS_CACHE_ALIAS='carts')
+    def test_checkout_histogram_uses_configured_cache(self):
+        caches['carts'].clear()
+        record_checkout(3, 0.02)
+        self.assertEqual(checkout_histogram()['2-5_lines']['le_25_ms'], 1)
+        self.assertIsNone(cache.get(KEY.format(lines=5, latency=25)))
+
+
+class StockReservationStressTests(CheckoutTestMixin, TransactionTestCase):
+    """Concurrent reservations on one SKU must never oversell"""
+
+    def test_no_oversell_under_concurrency(self):
+        product = self.create_product('HOT', stock=50)
+        results = []
+        lock = threading.Lock()
+        start = threading.Barrier(20)
+
+        def worker():
+            start.wait()
+            try:
+                for _ in range(15):
+                    while True:
+                        try:
+                            reserve_stock({product.pk: 1})
+                            outcome = 'reserved'
+                        except InsufficientStock:
+                            outcome = 'short'
+                        except OperationalError:
+                            # SQLite reports writer contention instead of blocking; retry
+                            continue
+                        break
+                    with lock:
+                        results.append(outcome)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(results), 300)
+        self.assertEqual(results.count('reserved'), 50)
+        self.assertEqual(product.stock, 0)
+
+
+class OrderNumberTests(CheckoutTestMixin, TestCase):
+    """Block-allocated, scrambled order numbers"""
+
+    PATTERN = r'^ORD-[0-9A-HJKMNP-TV-Z]{9}$'
+
+    def test_scramble_is_a_permutation(self):
+        values = range(1, 20001)
+        scrambled = {scramble(value) for value in values}
+        self.assertEqual(len(scrambled), len(values))
+        self.assertTrue(all(value < 1 << 44 for value in scrambled))
+        self.assertNotEqual(sorted(scrambled)[:5], list(values)[:5])
+
+    def test_one_round_trip_per_block(self):
+        first, second = OrderNumberAllocator('test', block_size=5), OrderNumberAllocator('test', block_size=5)
+        with CaptureQueriesContext(connection) as ctx:
+            numbers = [first.next() for _ in range(12)] + [second.next() for _ in range(3)]
+
+        self.assertEqual(len(set(numbers)), 15)
+        self.assertTrue(all(re.match(self.PATTERN, number) for number in numbers))
+        # Legacy numbers were ORD- plus 8 hex characters
+        self.assertFalse(any(re.match(r'^ORD-[0-9A-F]{8}$', number) for number in numbers))
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 4)
+        self.assertEqual(OrderNumberSequence.objects.get(name='test').next_value, 21)
+
+    def test_rolled_back_block_is_not_reused(self):
+        first = OrderNumberAllocator('rollback', block_size=5)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            first.next_value()
+            raise RuntimeError()
+        with transaction.atomic():
+            value = first.next_value()
+
+        second = OrderNumberAllocator('rollback', block_size=5)
+        self.assertNotIn(value, [second.next_value() for _ in range(5)])
+
+    def test_orders_get_allocated_numbers(self):
+        user = self.create_user()
+        product = self.create_product('SOCK', stock=5)
+        self.fill_cart(user, [(product, 1)])
+        client = APIClient()
+        client.force_authenticate(user)
+
+        checkout = client.post('/api/orders/orders/create_from_cart/', {'shipping_address': 'A'}, format='json')
+        direct = client.post('/api/orders/orders/', {
+            'shipping_address': 'B',
+            'items': [{'product': product.pk, 'quantity': 2, 'unit_price': '4.00'}],
+        }, format='json')
+
+        self.assertEqual(direct.status_code, 201, direct.data)
+        self.assertEqual(direct.data['total_amount'], '8.00')
+        self.assertRegex(checkout.data['order_number'], self.PATTERN)
+        self.assertRegex(direct.data['order_number'], self.PATTERN)
+        self.assertNotEqual(checkout.data['order_number'], direct.data['order_number'])
+
+
+class OrderRollupTests(CheckoutTestMixin, TestCase):
+    """Stats and sales analytics come from incrementally maintained rollups"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.staff = self.create_user('staff', is_staff=True)
+        self.client = APIClient()
+        self.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        self.boot = self.create_product('BOOT', stock=50, price=Decimal('30.00'))
+        self.sock = self.create_product('SOCK', stock=50, price=Decimal('5.00'))
+        self.boot.categories.add(self.shoes)
+
+    def checkout(self, lines):
+        self.fill_cart(self.buyer, lines)
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post(
+            '/api/orders/orders/create_from_cart/', {'shipping_address': 'A'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        Cart.objects.filter(user=self.buyer).delete()
+        return response.data['id']
+
+    def place_orders(self):
+        first = self.checkout([(self.boot, 2), (self.sock, 1)])
+        self.checkout([(self.sock, 4)])
+        cancelled = self.checkout([(self.boot, 1)])
+        self.client.post(f'/api/orders/orders/{cancelled}/cancel/')
+        self.client.post('/api/orders/orders/', {
+            'shipping_address': 'B',
+            'items': [{'product': self.boot.pk, 'quantity': 1, 'unit_price': '25.00'}],
+        }, format='json')
+        self.client.force_authenticate(self.staff)
+        self.client.post(f'/api/orders/orders/{first}/update_status/', {'status': 'shipped'}, format='json')
+
+    def test_stats_match_orders(self):
+        self.place_orders()
+        self.client.force_authenticate(self.staff)
+        with self.assertNumQueries(1):
+            stats = self.client.get('/api/orders/orders/stats/').data
+
+        self.assertEqual(stats['total_orders'], Order.objects.count())
+        self.assertEqual(stats['total_sales'], sum(o.total_amount for o in Order.objects.all()))
+        for status, _ in Order.STATUS_CHOICES:
+            self.assertEqual(stats[f'{status}_orders'], Order.objects.filter(status=status).count())
+        self.assertEqual((stats['shipped_orders'], stats['cancelled_orders']), (1, 1))
+
+    def test_range_and_granularity(self):
+        self.place_orders()
+        Order.objects.update(created_at=timezone.now())  # rollups keep the original buckets
+        self.client.force_authenticate(self.staff)
+        today = timezone.localdate()
+
+        response = self.client.get('/api/orders/orders/stats/', {
+            'start': today.isoformat(), 'end': (today + timedelta(days=1)).isoformat(), 'granularity': 'hour'
+        })
+        self.assertEqual(response.data['total_orders'], 4)
+        self.assertEqual(sum(b['total_orders'] for b in response.data['series']), 4)
+
+        response = self.client.get('/api/orders/orders/stats/', {'end': today.isoformat()})
+        self.assertEqual(response.data['total_orders'], 0)
+        self.assertNotIn('series', response.data)
+
+    def test_sales_analytics(self):
+        self.place_orders()
+        self.client.force_authenticate(self.staff)
+
+        products = self.client.get('/api/orders/analytics/top_products/').data
+        self.assertEqual(
+            [(p['product__sku'], p['units'], p['revenue']) for p in products],
+            [('BOOT', 3, Decimal('85.00')), ('SOCK', 5, Decimal('25.00'))]
+        )
+        by_units = self.client.get('/api/orders/analytics/top_products/', {'by': 'units', 'limit': 1}).data
+        self.assertEqual([p['product__sku'] for p in by_units], ['SOCK'])
+
+        categories = self.client.get('/api/orders/analytics/top_categories/').data
+        self.assertEqual([(c['category__name'], c['revenue']) for c in categories], [('Shoes', Decimal('85.00'))])
+
+        revenue = self.client.get('/api/orders/analytics/revenue/', {'period': 'month'}).data
+        self.assertEqual([(r['revenue'], r['orders']) for r in revenue], [(Decimal('110.00'), 3)])
+
+        aov = self.client.get('/api/orders/analytics/average_order_value/').data
+        self.assertEqual(aov['average_order_value'], Decimal('36.67'))
+
+    def test_categories_follow_recategorised_products(self):
+        self.client.force_authenticate(self.buyer)
+        order = self.checkout([(self.boot, 2)])
+        boots = Category.objects.create(name='Boots', slug='boots')
+        self.boot.categories.set([boots])
+        self.client.post(f'/api/orders/orders/{order}/cancel/')
+        self.checkout([(self.boot, 1)])
+
+        self.client.force_authenticate(self.staff)
+        categories = self.client.get('/api/orders/analytics/top_categories/').data
+        self.assertEqual(
+            [(c['category__name'], c['units'], c['revenue']) for c in categories], [('Boots', 1, Decimal('30.00'))]
+        )
+
+    def test_sales_and_stats_share_range_bounds(self):
+        self.place_orders()
+        self.client.force_authenticate(self.staff)
+        now = timezone.now().isoformat()
+
+        # A mid-day end keeps today in both; a mid-day start leaves it out of both
+        for params, expected in [({'end': now}, Decimal('110.00')), ({'start': now}, Decimal('0.00'))]:
+            revenue = self.client.get('/api/orders/analytics/revenue/', params).data
+            products = self.client.get('/api/orders/analytics/top_products/', params).data
+            self.assertEqual(sum((r['revenue'] for r in revenue), Decimal('0.00')), expected)
+            self.assertEqual(sum((p['revenue'] for p in products), Decimal('0.00')), expected)
+
+    def test_rebuild_matches_incremental(self):
+        self.place_orders()
+
+        def snapshot():
+            return (
+                sorted(OrderStats.objects.filter(order_count__gt=0).values_list(
+                    'granularity', 'bucket', 'status', 'order_count', 'total_amount'
+                )),
+                sorted(ProductSales.objects.filter(units__gt=0).values_list('day', 'product', 'units', 'revenue')),
+            )
+
+        incremental = snapshot()
+        call_command('rebuild_order_rollups', stdout=StringIO())
+        self.assertEqual(snapshot(), incremental)
+
+    def test_analytics_admin_only(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/orders/analytics/revenue/').status_code, 403)
+
+
+class OrderExportTests(CheckoutTestMixin, TestCase):
+    """Admins can stream every order and order item as CSV or NDJSON"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.staff = self.create_user('staff', is_staff=True)
+        self.product = self.create_product('MUG', stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        for i in range(5):
+            order = Order.objects.create(
+                order_number=f'ORD-{i}', user=self.buyer, total_amount=Decimal('10.00'),
+                shipping_address='Line 1,\n"Quoted" town', status='shipped' if i % 2 else 'pending'
+            )
+            OrderItem.objects.create(
+                order=order, product=self.product, quantity=1, unit_price=Decimal('10.00'), subtotal=Decimal('10.00')
+            )
+
+    def export(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response = self.client.get('/api/orders/orders/export/')
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'order_number', 'user_id'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][rows[0].index('shipping_address')], 'Line 1,\n"Quoted" town')
+
+    def test_ndjson_respects_filters(self):
+        lines = self.export('/api/orders/orders/export/', output='ndjson', status='shipped').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(sorted(row['order_number'] for row in rows), ['ORD-1', 'ORD-3'])
+        self.assertEqual(rows[0]['total_amount'], '10.00')
+        self.assertEqual(rows[0]['user__email'], self.buyer.email)
+
+    def test_order_items(self):
+        rows = list(csv.DictReader(StringIO(self.export('/api/orders/order-items/export/'))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['product__sku'] for row in rows}, {'MUG'})
+
+    def test_single_query_and_chunks(self):
+        with self.assertNumQueries(1):
+            pieces = list(export_rows(Order.objects.all(), ['id', 'order_number'], chunk_size=2))
+        # Header, then rows two at a time
+        self.assertEqual([piece.count('\n') for piece in pieces], [1, 2, 2, 1])
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/orders/orders/export/').status_code, 403)
+        self.assertEqual(self.client.get('/api/orders/order-items/export/').status_code, 403)
+
+
+class OrderListQueryTests(CheckoutTestMixin, TestCase):
+    """Order listings and details take a fixed number of queries"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.other = self.create_user('other')
+        self.staff = self.create_user('staff', is_staff=True)
+        self.products = [self.create_product(f'P{i}', stock=10) for i in range(3)]
+        self.client = APIClient()
+
+    def place(self, user, count, lines=2):
+        for _ in range(count):
+            order = Order.objects.create(
+                order_number=f'ORD-{Order.objects.count()}', user=user,
+                total_amount=Decimal('10.00'), shipping_address='x'
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=p, quantity=1, unit_price=p.price, subtotal=p.price)
+                for p in self.products[:lines]
+            ])
+        return order
+
+    def queries(self, user, path):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_staff_listing(self):
+        self.place(self.buyer, 2)
+        few, _ = self.queries(self.staff, '/api/orders/orders/')
+        self.place(self.other, 18, lines=3)
+        many, data = self.queries(self.staff, '/api/orders/orders/')
+
+        self.assertEqual(few, many)
+        self.assertEqual(many, 2)  # count + page
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(sorted({row['items_count'] for row in data['results']}), [2, 3])
+
+    def test_customer_listing(self):
+        self.place(self.buyer, 1)
+        few, _ = self.queries(self.buyer, '/api/orders/orders/')
+        self.place(self.buyer, 10)
+        self.place(self.other, 5)
+        many, data = self.queries(self.buyer, '/api/orders/orders/')
+
+        self.assertEqual(few, many)
+        self.assertEqual(data['count'], 11)
+
+    def test_detail(self):
+        order = self.place(self.buyer, 1, lines=3)
+        queries, data = self.queries(self.buyer, f'/api/orders/orders/{order.pk}/')
+
+        # Order with user, items with products, product images, product categories
+        self.assertEqual(queries, 4)
+        self.assertEqual(data['items_count'], 3)
+        self.assertEqual(data['user_details']['username'], 'buyer')
+
+
+class BulkStatusUpdateTests(CheckoutTestMixin, TestCase):
+    """Admins move many orders at once with set-based writes"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.staff = self.create_user('staff', is_staff=True)
+        self.product = self.create_product('MUG', stock=100, price=Decimal('5.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def place(self, count, status='pending'):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                order_number=f'ORD-{Order.objects.count()}', user=self.buyer,
+                total_amount=Decimal('10.00'), shipping_address='x', status=status
+            )
+            item = OrderItem.objects.create(
+                order=order, product=self.product, quantity=2, unit_price=Decimal('5.00'), subtotal=Decimal('10.00')
+            )
+            record_sales(order_lines(order, [item]))
+            orders.append(order)
+        return orders
+
+    def bulk(self, status, **payload):
+        response = self.client.post(
+            '/api/orders/orders/bulk_update_status/', dict(payload, status=status), format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_results_per_order(self):
+        pending, shipped, cancelled = self.place(1), self.place(1, 'shipped'), self.place(1, 'cancelled')
+        data = self.bulk(
+            'shipped',
+            ids=[pending[0].pk, shipped[0].pk, 999],
+            order_numbers=[cancelled[0].order_number, 'ORD-404'],
+        )
+
+        self.assertEqual(
+            [(r['order_number'], r['previous_status'], r['result']) for r in data['results']],
+            [
+                (pending[0].order_number, 'pending', 'updated'),
+                (shipped[0].order_number, 'shipped', 'unchanged'),
+                (None, None, 'not_found'),
+                (cancelled[0].order_number, 'cancelled', 'not_allowed'),
+                ('ORD-404', None, 'not_found'),
+            ]
+        )
+        self.assertEqual(data['counts'], {'updated': 1, 'unchanged': 1, 'not_found': 2, 'not_allowed': 1})
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 2)
+
+    def test_constant_queries(self):
+        def run(orders):
+            with CaptureQueriesContext(connection) as ctx:
+                self.bulk('shipped', ids=[order.pk for order in orders])
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run(self.place(2)), run(self.place(40)))
+
+    def test_cancel_restores_stock_and_rollups(self):
+        orders = self.place(3)
+        stock = Product.objects.get(pk=self.product.pk).stock
+        self.bulk('cancelled', order_numbers=[order.order_number for order in orders[:2]])
+
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, stock + 4)
+        self.assertEqual(ProductSales.objects.get().units, 2)
+        stats = self.client.get('/api/orders/orders/stats/').data
+        self.assertEqual((stats['pending_orders'], stats['cancelled_orders']), (1, 2))
+        self.assertEqual(stats['total_sales'], Decimal('30.00'))
+
+    def test_orders_across_many_buckets(self):
+        # 600 hourly buckets per pass; the second pass takes the backend path without ON CONFLICT
+        for backend_upsert, hours_ago in ((True, 700), (False, 1400)):
+            start = timezone.now() - timedelta(hours=hours_ago)
+            orders = Order.objects.bulk_create([
+                Order(
+                    order_number=f'SPREAD-{backend_upsert}-{i}', user=self.buyer,
+                    total_amount=Decimal('10.00'), shipping_address='x'
+                )
+                for i in range(600)
+            ])
+            for i, order in enumerate(orders):
+                order.created_at = start + timedelta(hours=i)
+            Order.objects.bulk_update(orders, ['created_at'])
+            # bulk_create skips the rollup signals, so count the orders in by hand
+            shift_order_stats([(o.created_at, 'pending', 1, o.total_amount) for o in orders])
+
+            with patch.object(connection.features, 'supports_update_conflicts_with_target', backend_upsert):
+                data = self.bulk('shipped', ids=[order.pk for order in orders])
+            self.assertEqual(data['counts'], {'updated': 600})
+
+            hourly = OrderStats.objects.filter(
+                granularity='hour', bucket__gte=start - timedelta(hours=1), bucket__lt=start + timedelta(hours=600)
+            )
+            self.assertEqual(hourly.filter(status='shipped', order_count=1).count(), 600)
+            self.assertFalse(hourly.filter(status='pending').exclude(order_count=0).exists())
+
+    def test_validation(self):
+        response = self.client.post('/api/orders/orders/bulk_update_status/', {'status': 'shipped'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post(
+            '/api/orders/orders/bulk_update_status/', {'status': 'shipped', 'ids': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderStateMachineTests(CheckoutTestMixin, TestCase):
+    """Every status change is checked against Order.TRANSITIONS and logged"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.staff = self.create_user('staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.order = Order.objects.create(
+            order_number='ORD-1', user=self.buyer, total_amount=Decimal('10.00'), shipping_address='x'
+        )
+
+    def update_status(self, status):
+        return self.client.post(
+            f'/api/orders/orders/{self.order.pk}/update_status/', {'status': status}, format='json'
+        )
+
+    def test_transitions_are_logged(self):
+        for status in ['processing', 'shipped', 'completed']:
+            self.assertEqual(self.update_status(status).status_code, 200)
+
+        self.assertEqual(
+            list(self.order.transitions.values_list('from_status', 'to_status', 'changed_by', 'source')),
+            [
+                ('pending', 'processing', self.staff.pk, 'api'),
+                ('processing', 'shipped', self.staff.pk, 'api'),
+                ('shipped', 'completed', self.staff.pk, 'api'),
+            ]
+        )
+
+    def test_invalid_transitions_are_rejected(self):
+        self.update_status('shipped')
+        response = self.update_status('pending')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('from shipped to pending', response.data['error'])
+
+        response = self.client.patch(f'/api/orders/orders/{self.order.pk}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'shipped')
+        self.assertEqual(self.order.transitions.count(), 1)
+
+    def test_admin_cancel_restores_stock(self):
+        product = self.create_product('LAMP', stock=5)
+        OrderItem.objects.create(
+            order=self.order, product=product, quantity=2, unit_price=Decimal('5.00'), subtotal=Decimal('10.00')
+        )
+        self.update_status('processing')
+        self.assertEqual(self.update_status('cancelled').status_code, 200)
+
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 7)
+        self.assertEqual(list(self.order.transitions.values_list('to_status', flat=True)), ['processing', 'cancelled'])
+        stats = self.client.get('/api/orders/orders/stats/').data
+        self.assertEqual((stats['processing_orders'], stats['cancelled_orders']), (0, 1))
+
+    def test_validation_needs_no_query(self):
+        self.order.status = 'shipped'
+        with self.assertNumQueries(0):
+            self.assertTrue(self.order.can_transition('completed'))
+            with self.assertRaises(InvalidTransition):
+                transition(self.order, 'processing')
+
+    def test_cancel_and_bulk_are_logged(self):
+        other = Order.objects.create(
+            order_number='ORD-2', user=self.buyer, total_amount=Decimal('10.00'), shipping_address='x'
+        )
+        self.client.post(f'/api/orders/orders/{self.order.pk}/cancel/')
+        self.client.post(
+            '/api/orders/orders/bulk_update_status/', {'status': 'shipped', 'ids': [other.pk]}, format='json'
+        )
+        self.assertEqual(
+            list(OrderTransition.objects.values_list('order__order_number', 'to_status', 'source')),
+            [('ORD-1', 'cancelled', 'cancel'), ('ORD-2', 'shipped', 'bulk')]
+        )
+        logged = OrderTransition.objects.get(source='bulk')
+        self.assertEqual((logged.from_status, logged.changed_by), ('pending', self.staff))
+        self.assertLess(timezone.now() - logged.created_at, timedelta(minutes=1))
+
+    def test_log_is_append_only(self):
+        transition(self.order, 'processing')
+        entry = OrderTransition.objects.get()
+        entry.to_status = 'shipped'
+        with self.assertRaises(ValueError):
+            entry.save()
+
+
+class CancelOrderTests(CheckoutTestMixin, TestCase):
+    """Cancelling restores stock set-based and only once"""
+
+    def setUp(self):
+        self.buyer = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def place(self, lines):
+        products = [self.create_product(f'C{Product.objects.count()}', stock=10) for _ in range(lines)]
+        order = Order.objects.create(
+            order_number=f'ORD-{lines}', user=self.buyer, total_amount=Decimal('10.00') * lines, shipping_address='x'
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=p, quantity=3, unit_price=p.price, subtotal=3 * p.price)
+            for p in products
+        ])
+        return order, products
+
+    def cancel(self, order):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/orders/orders/{order.pk}/cancel/')
+        return response, len(ctx.captured_queries)
+
+    def test_constant_queries(self):
+        small, _ = self.place(2)
+        large, products = self.place(100)
+        _, few = self.cancel(small)
+        response, many = self.cancel(large)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 13)
+        self.assertEqual(set(Product.objects.filter(pk__in=[p.pk for p in products]).values_list('stock', flat=True)), {13})
+
+    def test_double_cancel_restores_once(self):
+        order, [product] = self.place(1)
+        first, _ = self.cancel(order)
+        second, _ = self.cancel(order)
+
+        self.assertEqual((first.status_code, second.status_code), (200, 400))
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 13)
+        self.assertEqual(order.transitions.get().source, 'cancel')
+
+    def test_rollups_follow_cancel(self):
+        order, _ = self.place(2)
+        self.cancel(order)
+        stats = OrderStats.objects.filter(granularity='day').values_list('status', 'order_count', 'total_amount')
+        self.assertEqual(
+            {status: (count, amount) for status, count, amount in stats},
+            {'pending': (0, Decimal('0.00')), 'cancelled': (1, Decimal('20.00'))}
+        )
@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import CharField, DateTimeField, IntegerField, Q, Value
+from django.utils import timezone
+
+from apps.catalog.stock import release_stock
+from .models import Order, OrderItem, OrderTransition
+from .rollups import record_sales, shift_order_stats
+
+
+class InvalidTransition(Exception):
+    """Raised when the state machine does not allow a status change"""
+
+    def __init__(self, order, status):
+        self.from_status = order.status
+        self.to_status = status
+        super().__init__(f"Cannot change order status from {order.status} to {status}")
+
+
+class ConcurrentTransition(Exception):
+    """Raised when orders changed status while a bulk transition ran; nothing is applied"""
+
+
+def transition(order, status, user=None, source='api'):
+    """
+    Move `order` to `status` if Order.TRANSITIONS allows it, saving the
+    order and appending an OrderTransition. Checking the table costs no
+    query; moving to the current status is a no-op. Cancellations go
+    through bulk_transition, so they release the reserved stock whichever
+    endpoint cancels the order.
+    """
+    if status == order.status:
+        return False
+    if not order.can_transition(status):
+        raise InvalidTransition(order, status)
+
+    if status == 'cancelled':
+        [result] = bulk_transition(status, ids=[order.pk], user=user, source=source)
+        if result['result'] != 'updated':
+            raise InvalidTransition(order, status)
+        # bulk_transition already moved the rollups; later saves of this instance start from here
+        order.status = status
+        order._stored = (status, order.total_amount)
+        return True
+
+    previous = order.status
+    with transaction.atomic():
+        order.status = status
+        order.save(update_fields=['status', 'updated_at'])
+        OrderTransition.objects.create(
+            order=order, from_status=previous, to_status=status, changed_by=user, source=source
+        )
+    return True
+
+
+def bulk_transition(status, ids=(), order_numbers=(), user=None, source='bulk'):
+    """
+    Move many orders to `status` at once, following Order.TRANSITIONS.
+
+    The orders are read (and locked) by one query and moved by one
+    conditional UPDATE; the rollups, sales facts and, for cancellations,
+    product stock are then adjusted in bulk. Returns one result per
+    requested id or order number, in request order, with the outcome
+    `updated`, `unchanged`, `not_allowed` or `not_found`.
+    """
+    sources = [source for source, targets in Order.TRANSITIONS.items() if status in targets]
+
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update().filter(Q(pk__in=ids) | Q(order_number__in=order_numbers))
+            .order_by().values('id', 'order_number', 'status', 'total_amount', 'created_at')
+        )
+        moved = [order for order in orders if order['status'] in sources]
+        if moved:
+            # The locks keep these rows as read; the conditional UPDATE is a second guard
+            # (e.g. against a double cancel where rows cannot be locked)
+            targets = Order.objects.filter(pk__in=[order['id'] for order in moved], status__in=sources)
+            _log_transitions(targets, status, user, source)
+            if targets.update(status=status, updated_at=timezone.now()) != len(moved):
+                raise ConcurrentTransition()
+            _adjust_rollups(moved, status)
+
+    by_id = {order['id']: order for order in orders}
+    by_number = {order['order_number']: order for order in orders}
+    moved_ids = {order['id'] for order in moved}
+    requested = [by_id.get(pk, {'id': pk}) for pk in ids]
+    requested += [by_number.get(number, {'order_number': number}) for number in order_numbers]
+
+    results = []
+    for order in requested:
+        if 'status' not in order:
+            outcome = 'not_found'
+        elif order['id'] in moved_ids:
+            outcome = 'updated'
+        elif order['status'] == status:
+            outcome = 'unchanged'
+        else:
+            outcome = 'not_allowed'
+        results.append({
+            'id': order.get('id'),
+            'order_number': order.get('order_number'),
+            'previous_status': order.get('status'),
+            'result': outcome,
+        })
+    return results
+
+
+def _log_transitions(orders, status, user, source):
+    """Append a transition to `status` for every order of `orders` with one INSERT ... SELECT"""
+    rows = orders.order_by().annotate(
+        log_to_status=Value(status, output_field=CharField()),
+        log_changed_by=Value(user.pk if user else None, output_field=IntegerField()),
+        log_source=Value(source, output_field=CharField()),
+        log_created_at=Value(timezone.now(), output_field=DateTimeField()),
+    ).values_list(
+        'id', 'status', 'log_to_status', 'log_changed_by', 'log_source', 'log_created_at'
+    )
+    select, params = rows.query.sql_with_params()
+    meta = OrderTransition._meta
+    columns = ', '.join(
+        connection.ops.quote_name(meta.get_field(name).column)
+        for name in ['order', 'from_status', 'to_status', 'changed_by', 'source', 'created_at']
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(meta.db_table)} ({columns}) {select}', params)
+
+
+def _adjust_rollups(moved, status):
+    """Rollups, sales facts and stock for orders a set-based UPDATE moved to `status`"""
+    shift_order_stats(
+        [(order['created_at'], order['status'], -1, -order['total_amount']) for order in moved] +
+        [(order['created_at'], status, 1, order['total_amount']) for order in moved]
+    )
+
+    cancelled = [order for order in moved if (order['status'] == 'cancelled') != (status == 'cancelled')]
+    if not cancelled:
+        return
+    created_at = {order['id']: order['created_at'] for order in cancelled}
+    lines = [
+        dict(line, created_at=created_at[line['order_id']])
+        for line in OrderItem.objects.filter(order_id__in=created_at).values(
+            'order_id', 'product_id', 'quantity', 'subtotal'
+        )
+    ]
+    record_sales(lines, sign=-1 if status == 'cancelled' else 1)
+
+    if status == 'cancelled':
+        quantities = defaultdict(int)
+        for line in lines:
+            quantities[line['product_id']] += line['quantity']
+        release_stock(quantities)
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, OrderItemViewSet
+from .views import OrderViewSet, OrderItemViewSet, SalesAnalyticsViewSet
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'order-items', OrderItemViewSet, basename='orderitem')
+router.register(r'analytics', SalesAnalyticsViewSet, basename='sales-analytics')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,8 +1,22 @@
+import time
+from decimal import Decimal
 from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from apps.idempotency.decorators import idempotent
+from apps.catalog.models import listing_prefetches
+from apps.catalog.stock import InsufficientStock, reserve_stock
+from . import analytics
+from .analytics import order_stats
+from .exports import export_response
+from .metrics import checkout_histogram, record_checkout
+from .numbers import next_order_number
+from .rollups import order_lines, record_sales
+from .transitions import ConcurrentTransition, InvalidTransition, bulk_transition, transition
 from .models import Order, OrderItem
 from .serializers import (
     OrderSerializer,
@@ -10,6 +24,10 @@ from .serializers import (
     OrderItemSerializer,
     CreateOrderFromCartSerializer,
     OrderStatusUpdateSerializer,
+    OrderStatsQuerySerializer,
+    SalesAnalyticsQuerySerializer,
+    ExportQuerySerializer,
+    BulkOrderStatusSerializer,
 )
 
 
@@ -26,6 +44,10 @@ class IsOwnerOrAdminPermission(permissions.BasePermission):
 class OrderViewSet(viewsets.ModelViewSet):
     """ViewSet for managing orders"""
     serializer_class = OrderSerializer
+    export_fields = [
+        'id', 'order_number', 'user_id', 'user__email', 'status', 'total_amount',
+        'shipping_address', 'created_at', 'updated_at',
+    ]
     permission_classes = [IsOwnerOrAdminPermission]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['status', 'created_at']
@@ -33,9 +55,23 @@ class OrderViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
 
     def get_queryset(self):
-        if self.request.user.is_staff:
-            return Order.objects.all().prefetch_related('items__product')
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+        queryset = Order.objects.select_related('user')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+
+        if self.action == 'cancel':
+            # Cancelling reads and writes the order rows set-based, nothing to prefetch
+            return queryset
+        if self.action == 'list':
+            # Lists only show the number of lines, counted per page row by the database
+            items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+            return queryset.annotate(
+                items_count=Coalesce(Subquery(items.annotate(c=Count('id')).values('c')), Value(0))
+            )
+        return queryset.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+            *listing_prefetches('items__product__')
+        )
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -46,13 +82,19 @@ class OrderViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     @action(detail=False, methods=['POST'])
+    @idempotent
     def create_from_cart(self, request):
         """Create order from current cart"""
         serializer = CreateOrderFromCartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         from apps.carts.models import Cart
-        
+        from apps.carts.serializers import CartItemSerializer
+        from apps.carts.storage import get_cart_storage
+
+        # Bring in a guest cart still held by the guest storage backend
+        get_cart_storage(request)
+
         # Get user's cart
         cart = Cart.objects.filter(
             user=request.user, 
@@ -65,46 +107,63 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Validate stock for all items
-        for item in cart.items.all():
-            if item.quantity > item.product.stock:
-                return Response(
-                    {'error': f'Not enough stock for {item.product.name}. Available: {item.product.stock}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        items = list(cart.items.all())
 
+        # Charge current prices, not the ones captured when the lines were added. The
+        # repriced cart is kept, so the client confirms the new prices by checking out again
+        changed = cart.reprice(items)
+        if changed:
+            return Response(
+                {
+                    'error': 'Prices changed since the items were added; review the cart and check out again',
+                    'changed_items': CartItemSerializer(changed, many=True).data,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+
+        order_number = next_order_number()
+        started = time.perf_counter()
         try:
             with transaction.atomic():
+                # Reserve stock for every line, or fail without touching any
+                quantities = {}
+                for item in items:
+                    quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+                reserve_stock(quantities)
+
                 # Create order
-                import uuid
                 order = Order.objects.create(
-                    order_number=f"ORD-{uuid.uuid4().hex[:8].upper()}",
+                    order_number=order_number,
                     user=request.user,
                     shipping_address=serializer.validated_data['shipping_address'],
-                    total_amount=cart.total_amount
+                    total_amount=sum((item.subtotal for item in items), Decimal('0.00'))
                 )
 
-                # Create order items and update stock
-                for cart_item in cart.items.all():
-                    OrderItem.objects.create(
+                # Create order items
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
                         product=cart_item.product,
                         quantity=cart_item.quantity,
                         unit_price=cart_item.unit_price,
                         subtotal=cart_item.subtotal
                     )
-                    
-                    # Update product stock
-                    product = cart_item.product
-                    product.stock -= cart_item.quantity
-                    product.save()
+                    for cart_item in items
+                ])
+                record_sales(order_lines(order, items))
 
                 # Clear cart
                 cart.items.all().delete()
 
-                order_serializer = OrderSerializer(order)
-                return Response(order_serializer.data, status=status.HTTP_201_CREATED)
+            record_checkout(len(items), time.perf_counter() - started)
+            order_serializer = OrderSerializer(order)
+            return Response(order_serializer.data, status=status.HTTP_201_CREATED)
 
+        except InsufficientStock as e:
+            return Response(
+                {'error': 'Not enough stock', 'shortfalls': e.shortfalls},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {'error': f'Failed to create order: {str(e)}'},
@@ -130,7 +189,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         
-        new_status = serializer.validated_data.get('status')
+        new_status = serializer.validated_data.get('status', order.status)
         
         # Customers can only cancel pending orders
         if not request.user.is_staff:
@@ -140,69 +199,139 @@ class OrderViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-        serializer.save()
+        try:
+            transition(order, new_status, user=request.user)
+        except (InvalidTransition, ConcurrentTransition) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response(OrderSerializer(order).data)
 
+    @action(detail=False, methods=['POST'], permission_classes=[permissions.IsAdminUser])
+    def bulk_update_status(self, request):
+        """Move many orders to one status at once (Admin only)"""
+        serializer = BulkOrderStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = bulk_transition(user=request.user, **serializer.validated_data)
+        except ConcurrentTransition:
+            return Response(
+                {'error': 'Some orders changed status meanwhile; nothing was updated, please retry'},
+                status=status.HTTP_409_CONFLICT
+            )
+        counts = {}
+        for result in results:
+            counts[result['result']] = counts.get(result['result'], 0) + 1
+        return Response({
+            'status': serializer.validated_data['status'],
+            'counts': counts,
+            'results': results,
+        })
+
     @action(detail=True, methods=['POST'])
     def cancel(self, request, pk=None):
         """Cancel order"""
         order = self.get_object()
         
-        if order.status not in ['pending', 'processing']:
+        if not order.can_transition('cancelled'):
             return Response(
                 {'error': 'Order cannot be cancelled'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # One conditional UPDATE moves the order, so a second cancel never restores stock twice;
+        # stock comes back through one UPDATE for all products
         try:
-            with transaction.atomic():
-                # Restore stock
-                for item in order.items.all():
-                    product = item.product
-                    product.stock += item.quantity
-                    product.save()
-
-                order.status = 'cancelled'
-                order.save()
-
-                return Response({'message': 'Order cancelled successfully'})
-
-        except Exception as e:
+            transition(order, 'cancelled', user=request.user, source='cancel')
+        except (InvalidTransition, ConcurrentTransition):
             return Response(
-                {'error': f'Failed to cancel order: {str(e)}'},
+                {'error': 'Order cannot be cancelled'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return Response({'message': 'Order cancelled successfully'})
+
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Stream all orders as CSV or NDJSON (Admin only)"""
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return export_response(
+            self.filter_queryset(Order.objects.all()),
+            self.export_fields, 'orders', params.validated_data['output']
+        )
+
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def checkout_metrics(self, request):
+        """Get checkout transaction time histogram per number of lines (Admin only)"""
+        return Response(checkout_histogram())
 
     @action(detail=False, methods=['GET'])
     def stats(self, request):
-        """Get order statistics (Admin only)"""
+        """Get order statistics, optionally for a date range and per hour/day (Admin only)"""
         if not request.user.is_staff:
             return Response(
                 {'error': 'Permission denied'},
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        from django.db.models import Count, Sum
-        from decimal import Decimal
+        params = OrderStatsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        granularity = params.validated_data.get('granularity')
+
+        return Response(order_stats(
+            start=params.validated_data.get('start'),
+            end=params.validated_data.get('end'),
+            granularity=granularity or 'day',
+            series=granularity is not None
+        ))
 
-        stats = Order.objects.aggregate(
-            total_orders=Count('id'),
-            total_sales=Sum('total_amount'),
-            pending_orders=Count('id', filter=Q(status='pending')),
-            processing_orders=Count('id', filter=Q(status='processing')),
-            completed_orders=Count('id', filter=Q(status='completed')),
-            cancelled_orders=Count('id', filter=Q(status='cancelled'))
-        )
 
-        stats['total_sales'] = stats['total_sales'] or Decimal('0.00')
+class SalesAnalyticsViewSet(viewsets.ViewSet):
+    """Sales analytics read from the incrementally maintained sales facts (Admin only)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_params(self, request):
+        params = SalesAnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data
+
+    @action(detail=False, methods=['GET'])
+    def top_products(self, request):
+        """Get the best selling products by revenue or units"""
+        params = self.get_params(request)
+        return Response(analytics.top_products(
+            params.get('start'), params.get('end'), params['limit'], params['by']
+        ))
+
+    @action(detail=False, methods=['GET'])
+    def top_categories(self, request):
+        """Get the best selling categories by revenue or units"""
+        params = self.get_params(request)
+        return Response(analytics.top_categories(
+            params.get('start'), params.get('end'), params['limit'], params['by']
+        ))
+
+    @action(detail=False, methods=['GET'])
+    def revenue(self, request):
+        """Get revenue per day, week or month"""
+        params = self.get_params(request)
+        return Response(analytics.revenue_series(params.get('start'), params.get('end'), params['period']))
+
+    @action(detail=False, methods=['GET'])
+    def average_order_value(self, request):
+        """Get the average order value"""
+        params = self.get_params(request)
+        return Response(analytics.average_order_value(params.get('start'), params.get('end')))
 
-        return Response(stats)
 
 class OrderItemViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing order items"""
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
     permission_classes = [IsOwnerOrAdminPermission]
+    export_fields = [
+        'id', 'order_id', 'order__order_number', 'product_id', 'product__sku',
+        'quantity', 'unit_price', 'subtotal',
+    ]
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -210,3 +339,13 @@ class OrderItemViewSet(viewsets.ReadOnlyModelViewSet):
         return OrderItem.objects.filter(
             order__user=self.request.user
         ).select_related('order', 'product')
+
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Stream all order items as CSV or NDJSON (Admin only)"""
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return export_response(
+            OrderItem.objects.order_by('order_id', 'id'),
+            self.export_fields, 'order-items', params.validated_data['output']
+        )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.payments.webhooks import process_webhooks
+
+
+class Command(BaseCommand):
+    help = 'Process queued payment webhooks; run several instances to scale out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new webhooks')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            handled = process_webhooks(batch_size=options['batch_size'])
+            total += handled
+            if handled:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} webhooks'))
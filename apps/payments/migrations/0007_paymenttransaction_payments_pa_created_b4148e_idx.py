@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_paymentmethod_paymentrefund_paymentwebhook_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['created_at', 'id'], name='payments_pa_created_b4148e_idx'),
+        ),
+    ]
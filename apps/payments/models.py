@@ -291,10 +291,10 @@ class Payment(models.Model):
         self.refundable_amount = self.amount
         self.save()
 
-        # Update order status
-        if hasattr(self.order, 'status'):
-            self.order.status = 'processing'
-            self.order.save()
+        # Update order status, unless it has already moved past payment
+        from apps.orders.transitions import transition
+        if self.order.can_transition('processing'):
+            transition(self.order, 'processing', source='payment')
 
     def mark_as_failed(self, reason=None):
         """Marks the payment as failed"""
@@ -421,6 +421,7 @@ class PaymentTransaction(models.Model):
             models.Index(fields=['payment', 'transaction_type']),
             models.Index(fields=['transaction_id']),
             models.Index(fields=['success', 'created_at']),
+            models.Index(fields=['created_at', 'id']),
         ]
 
     def __str__(self):
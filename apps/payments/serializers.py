@@ -23,7 +23,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     order_details = serializers.SerializerMethodField()
     is_completed = serializers.BooleanField(read_only=True)
-    can_be_refunded = serializers.BooleanField(read_only=True)
+    can_be_refunded = serializers.BooleanField(source='is_refundable', read_only=True)
 
     class Meta:
         model = Payment
@@ -67,11 +67,6 @@ class PaymentSerializer(serializers.ModelSerializer):
         if len(value) != 3:
             raise serializers.ValidationError("Currency must be a 3-character ISO code.")
         return value.upper()
-    
-    def can_be_refunded(self, value):
-        if value is True:
-            return True
-        return False
 
 class PaymentListSerializer(serializers.ModelSerializer):
     """Simplified payment serializer for list views"""
@@ -151,7 +146,7 @@ class PaymentRefundSerializer(serializers.Serializer):
         payment = self.context['payment']
         amount = data.get('amount')
         
-        if not payment.can_be_refunded():
+        if not payment.is_refundable:
             raise serializers.ValidationError("This payment cannot be refunded.")
         
         if amount and amount > payment.amount:
@@ -1 +1,135 @@
+import csv
+import json
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.catalog.models import Product
+from apps.orders.models import Order, OrderItem
+from .models import Payment, PaymentWebhook
+
+
+class WebhookQueueTests(TestCase):
+    """Webhooks are stored on receipt and applied by the worker"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.order = Order.objects.create(
+            order_number='ORD-1', user=self.user, total_amount=Decimal('30.00'), shipping_address='x'
+        )
+        self.payment = Payment.objects.create(order=self.order, amount=Decimal('30.00'))
+
+    def post_webhook(self, **payload):
+        return self.client.post('/api/payments/payments/webhook/', payload, format='json')
+
+    def test_receipt_is_a_single_insert(self):
+        with self.assertNumQueries(1):
+            response = self.post_webhook(event_id='evt_1', payment_id=str(self.payment.pk), status='succeeded')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(PaymentWebhook.objects.get().status, 'received')
+
+    def test_duplicate_events_are_stored_once(self):
+        for _ in range(3):
+            self.post_webhook(event_id='evt_1', payment_id=str(self.payment.pk), status='succeeded')
+        self.post_webhook(payment_id=str(self.payment.pk), status='failed')
+        self.post_webhook(payment_id=str(self.payment.pk), status='failed')
+        self.assertEqual(PaymentWebhook.objects.count(), 2)
+
+    def test_worker_applies_webhooks(self):
+        self.post_webhook(
+            event_id='evt_ok', payment_id=str(self.payment.pk), status='succeeded', transaction_id='tx_9'
+        )
+        self.post_webhook(event_id='evt_missing', payment_id='00000000-0000-0000-0000-000000000000')
+
+        call_command('process_webhooks', stdout=StringIO())
+
+        ok = PaymentWebhook.objects.get(event_id='evt_ok')
+        self.assertEqual(ok.status, 'processed')
+        self.assertEqual(ok.payment, self.payment)
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.STATUS_SUCCEEDED)
+        self.assertEqual(self.payment.transaction_id, 'tx_9')
+        self.assertEqual(self.order.status, 'processing')
+
+        missing = PaymentWebhook.objects.get(event_id='evt_missing')
+        self.assertEqual(missing.status, 'failed')
+        self.assertEqual(missing.error_message, 'Payment not found')
+
+
+class PaymentExportTests(TestCase):
+    """Admins can stream payments and their transactions"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.staff = User.objects.create_user(username='staff', email='staff@example.com', password='pass', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        for i in range(3):
+            order = Order.objects.create(
+                order_number=f'ORD-{i}', user=self.user, total_amount=Decimal('30.00'), shipping_address='x'
+            )
+            Payment.objects.create(order=order, amount=Decimal('30.00'))
+
+    def test_payments_and_transactions(self):
+        response = self.client.get('/api/payments/payments/export/')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(sorted(row['order__order_number'] for row in rows), ['ORD-0', 'ORD-1', 'ORD-2'])
+        self.assertEqual({row['net_amount'] for row in rows}, {'30.00'})
+
+        response = self.client.get('/api/payments/payment-transactions/export/', {'output': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        transactions = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({t['transaction_type'] for t in transactions}, {'payment'})
+        self.assertEqual(len(transactions), 3)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/payments/payments/export/').status_code, 403)
+        self.assertEqual(self.client.get('/api/payments/payment-transactions/export/').status_code, 403)
+
+
+class PaymentRefundTests(TestCase):
+    """Refunds cancel unshipped orders and return their stock"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass')
+        self.staff = User.objects.create_user(username='staff', email='staff@example.com', password='pass', is_staff=True)
+        self.product = Product.objects.create(
+            sku='KETTLE', slug='kettle', name='Kettle', price=Decimal('15.00'), stock=4
+        )
+        self.order = Order.objects.create(
+            order_number='ORD-1', user=self.user, total_amount=Decimal('30.00'), shipping_address='x'
+        )
+        OrderItem.objects.create(
+            order=self.order, product=self.product, quantity=2, unit_price=Decimal('15.00'), subtotal=Decimal('30.00')
+        )
+        self.payment = Payment.objects.create(order=self.order, amount=Decimal('30.00'))
+        self.payment.mark_as_succeeded(transaction_id='tx_1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def refund(self):
+        return self.client.post(f'/api/payments/payments/{self.payment.pk}/refund/', {}, format='json')
+
+    def test_refund_cancels_and_restores_stock(self):
+        self.assertEqual(self.refund().status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.assertEqual(self.order.transitions.last().source, 'refund')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 6)
+
+    def test_refund_after_shipping_keeps_stock(self):
+        Order.objects.filter(pk=self.order.pk).update(status='shipped')
+        self.assertEqual(self.refund().status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'shipped')
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 4)
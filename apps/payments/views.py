@@ -3,7 +3,12 @@ from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from apps.idempotency.decorators import idempotent
+from apps.orders.exports import export_response
+from apps.orders.serializers import ExportQuerySerializer
+from apps.orders.transitions import transition
 from .models import Payment, PaymentTransaction
+from .webhooks import enqueue_webhook
 from .serializers import (
     PaymentSerializer,
     PaymentListSerializer,
@@ -29,6 +34,11 @@ class PaymentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsOwnerOrAdminPermission]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['status', 'currency']
+    export_fields = [
+        'id', 'order_id', 'order__order_number', 'type', 'status', 'amount', 'currency',
+        'fee_amount', 'net_amount', 'refunded_amount', 'provider', 'transaction_id',
+        'created_at', 'captured_at',
+    ]
     ordering_fields = ['created_at', 'amount']
     ordering = ['-created_at']
 
@@ -57,6 +67,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         serializer.save()
 
     @action(detail=True, methods=['POST'])
+    @idempotent
     def process(self, request, pk=None):
         """Process payment (simulate payment gateway)"""
         payment = self.get_object()
@@ -74,7 +85,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         try:
             if success:
-                payment.mark_as_succeded(transaction_id=transaction_id)
+                payment.mark_as_succeeded(transaction_id=transaction_id)
                 
                 # Create successful transaction record
                 PaymentTransaction.objects.create(
@@ -107,6 +118,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['POST'])
+    @idempotent
     def refund(self, request, pk=None):
         """Refund payment"""
         payment = self.get_object()
@@ -123,7 +135,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
 
-        if not payment.can_be_refunded():
+        if not payment.is_refundable:
             return Response(
                 {'error': 'Payment cannot be refunded'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -150,9 +162,9 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 }
             )
 
-            # Update order status
-            payment.order.status = 'cancelled'
-            payment.order.save()
+            # Cancel the order, unless it has already shipped
+            if payment.order.can_transition('cancelled'):
+                transition(payment.order, 'cancelled', user=request.user, source='refund')
 
             return Response({
                 'message': 'Refund processed successfully',
@@ -203,46 +215,26 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
         return Response(stats)
 
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Stream all payments as CSV or NDJSON (Admin only)"""
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return export_response(
+            self.filter_queryset(Payment.objects.all()),
+            self.export_fields, 'payments', params.validated_data['output']
+        )
+
     @action(detail=False, methods=['POST'])
     def webhook(self, request):
-        """Handle payment gateway webhooks"""
-        # This would handle real payment gateway webhooks
-        # Implementation depends on the specific payment provider
-        
-        # Example webhook handling:
-        webhook_data = request.data
-        payment_id = webhook_data.get('payment_id')
-        status = webhook_data.get('status')
-        transaction_id = webhook_data.get('transaction_id')
-
-        try:
-            payment = Payment.objects.get(id=payment_id)
-            
-            # Create transaction record
-            PaymentTransaction.objects.create(
-                payment=payment,
-                success=status == 'succeeded',
-                raw_response=webhook_data
-            )
-
-            # Update payment status
-            if status == 'succeeded':
-                payment.mark_as_succeded(transaction_id=transaction_id)
-            elif status == 'failed':
-                payment.mark_as_failed(reason=webhook_data.get('failure_reason'))
-
-            return Response({'status': 'webhook processed'})
-
-        except Payment.DoesNotExist:
-            return Response(
-                {'error': 'Payment not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Exception as e:
-            return Response(
-                {'error': f'Webhook processing failed: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        """Queue a payment gateway webhook for the webhook worker"""
+        headers = {
+            name: value for name, value in request.headers.items()
+            if name.lower() not in ('authorization', 'cookie')
+        }
+        payload = request.data.dict() if hasattr(request.data, 'dict') else request.data
+        enqueue_webhook(payload, headers=headers)
+        return Response({'status': 'webhook received'}, status=status.HTTP_202_ACCEPTED)
 
 
 class PaymentTransactionViewSet(viewsets.ReadOnlyModelViewSet):
@@ -253,10 +245,24 @@ class PaymentTransactionViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_fields = ['success']
     ordering_fields = ['created_at']
     ordering = ['-created_at']
+    export_fields = [
+        'id', 'payment_id', 'transaction_type', 'transaction_id', 'amount', 'currency',
+        'success', 'status_code', 'provider', 'message', 'created_at',
+    ]
 
     def get_queryset(self):
         if self.request.user.is_staff:
             return PaymentTransaction.objects.all().select_related('payment__order__user')
         return PaymentTransaction.objects.filter(
             payment__order__user=self.request.user
-        ).select_related('payment__order')
\ No newline at end of file
+        ).select_related('payment__order')
+
+    @action(detail=False, methods=['GET'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """Stream all payment transactions as CSV or NDJSON (Admin only)"""
+        params = ExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return export_response(
+            self.filter_queryset(PaymentTransaction.objects.all()),
+            self.export_fields, 'payment-transactions', params.validated_data['output']
+        )
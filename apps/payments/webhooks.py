@@ -0,0 +1,88 @@
+import hashlib
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Payment, PaymentTransaction, PaymentWebhook
+
+
+def enqueue_webhook(payload, headers=None):
+    """
+    Persist a provider callback for the webhook worker with a single INSERT.
+
+    Deliveries are deduplicated on `event_id`; payloads without one are
+    keyed by a hash of their content so identical retries collapse.
+    """
+    event_id = payload.get('event_id') or payload.get('id')
+    if not event_id:
+        canonical = json.dumps(payload, sort_keys=True, default=str)
+        event_id = f"sha256:{hashlib.sha256(canonical.encode()).hexdigest()}"
+
+    provider = payload.get('provider', 'other')
+    if provider not in dict(PaymentWebhook.PROVIDER_CHOICES):
+        provider = 'other'
+
+    PaymentWebhook.objects.bulk_create(
+        [
+            PaymentWebhook(
+                provider=provider,
+                event_type=payload.get('event_type') or payload.get('type') or payload.get('status') or '',
+                event_id=str(event_id),
+                raw_payload=payload,
+                headers=headers or {},
+                signature=(headers or {}).get('Stripe-Signature', ''),
+            )
+        ],
+        ignore_conflicts=True
+    )
+
+
+def handle_webhook(webhook):
+    """Apply one received webhook to its payment"""
+    data = webhook.raw_payload
+    payment_status = data.get('status')
+
+    try:
+        payment = Payment.objects.select_related('order').get(id=data.get('payment_id'))
+    except (Payment.DoesNotExist, ValidationError, ValueError):
+        webhook.mark_as_failed('Payment not found')
+        return
+
+    PaymentTransaction.objects.create(
+        payment=payment,
+        transaction_type='webhook',
+        transaction_id=data.get('transaction_id') or '',
+        success=payment_status == 'succeeded',
+        raw_response=data
+    )
+
+    if payment_status == 'succeeded':
+        payment.mark_as_succeeded(transaction_id=data.get('transaction_id'))
+    elif payment_status == 'failed':
+        payment.mark_as_failed(reason=data.get('failure_reason'))
+
+    webhook.mark_as_processed(payment=payment)
+
+
+def process_webhooks(batch_size=100):
+    """
+    Drain one batch of received webhooks and return how many were handled.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+    workers can drain the queue concurrently without handling a row twice.
+    Each webhook runs in its own savepoint; a failure marks only that row.
+    """
+    with transaction.atomic():
+        batch = list(
+            PaymentWebhook.objects.select_for_update(skip_locked=True)
+            .filter(status='received')
+            .order_by('created_at')[:batch_size]
+        )
+        for webhook in batch:
+            try:
+                with transaction.atomic():
+                    handle_webhook(webhook)
+            except Exception as e:
+                webhook.mark_as_failed(str(e))
+    return len(batch)
@@ -0,0 +1,163 @@
+import base64
+import datetime
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """JSON encoder that keeps full microsecond precision for datetimes"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page number pagination with an opt-in keyset mode.
+
+    Requests without a `cursor` parameter keep the regular `?page=` behaviour.
+    Sending `?cursor=` (empty for the first page) switches to keyset mode:
+    pages are located with a `WHERE` on the ordering fields of the last row
+    seen instead of an `OFFSET`, so deep pages cost the same as the first one.
+    The ordering in effect (including `?ordering=`) is used as the key, with
+    the primary key appended as a tie-breaker. Keyset mode also accepts
+    `?count=false` to skip the `COUNT(*)` for infinite-scroll clients.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.count = None
+        if request.query_params.get(self.count_query_param) != 'false':
+            self.count = queryset.order_by().count()
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = position is not None and (has_more if reverse else True)
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        payload = {}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.rows:
+            return None
+        return self.build_link(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.rows:
+            return None
+        return self.build_link(self.rows[0], reverse=True)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = ordering and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """Rows strictly after `position` in `ordering`, expanded as (a > x) OR (a = x AND b > y) ..."""
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(ordering[:index], position):
+                condition &= Q(**{previous.lstrip('-'): value})
+            conditions.append(condition)
+        return reduce(or_, conditions)
+
+    def build_link(self, row, reverse):
+        position = []
+        for field in self.ordering:
+            value = row
+            for part in field.lstrip('-').split('__'):
+                value = getattr(value, part)
+            position.append(value)
+
+        raw = json.dumps({'p': position, 'r': reverse}, cls=CursorEncoder)
+        cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def ordering_field(model, name):
+        """Model field behind an ordering name such as `created_at`, `pk` or `user__username`"""
+        *relations, last = name.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.pk if last == 'pk' else model._meta.get_field(last)
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            position, reverse = data['p'], bool(data['r'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        try:
+            # Cursors come from clients: every value must be valid for its field
+            position = [
+                self.ordering_field(model, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+        if None in position:
+            raise NotFound('Invalid cursor')
+        return position, reverse
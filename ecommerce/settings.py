@@ -31,10 +31,54 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'ecommerce.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
 }
 
+# Cache definition
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+    },
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 5
+CATALOG_FACETS_CACHE_TIMEOUT = 60
+CATALOG_PRICE_BANDS = [25, 50, 100, 200]
+
+# Guest carts live in CART_GUEST_STORAGE until the guest signs in. The cache
+# backend needs a cache shared by all workers (e.g. Redis) in production;
+# use 'apps.carts.storage.DatabaseCartStorage' for session-keyed Cart rows.
+CART_GUEST_STORAGE = 'apps.carts.storage.CacheCartStorage'
+CART_CACHE_ALIAS = 'carts'
+CART_COOKIE_NAME = 'cart_token'
+CART_GUEST_TTL = 60 * 60 * 24 * 7
+# Anonymous and inactive carts idle this long are removed by reap_abandoned_carts
+CART_ABANDONED_AFTER_DAYS = 30
+
+# Order numbers: PREFIX + 9 base32 characters, one longer than legacy ORD-<8 hex>
+# numbers so the two can never collide. Blocks of BLOCK_SIZE numbers are
+# reserved per worker thread. ORDER_NUMBER_KEY (defaults to SECRET_KEY) keys the
+# scrambling; changing it once orders exist can reissue existing numbers.
+ORDER_NUMBER_PREFIX = 'ORD-'
+ORDER_NUMBER_BLOCK_SIZE = 1000
+
+# The checkout latency histogram is counted in this cache. Every worker must
+# share it (e.g. Redis) for checkout_metrics to report all of them
+ORDERS_METRICS_CACHE_ALIAS = 'default'
+
+# Replayed responses for Idempotency-Key requests are kept this long (seconds)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# A request holds its key this long (seconds); a retry after that takes the key
+# over, e.g. when the worker that held it was killed. Keep it above the request timeout
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
 # User model definition
 
 AUTH_USER_MODEL = 'accounts.User'
@@ -57,6 +101,7 @@ INSTALLED_APPS = [
     'apps.orders',
     'apps.carts',
     'apps.payments',
+    'apps.idempotency',
 ]
 
 MIDDLEWARE = [